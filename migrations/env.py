@@ -16,10 +16,20 @@ fileConfig(config.config_file_name)  # type: ignore
 
 from server.articles.model import *
 from server.common.database import Base
+from server.common.outbox import OutboxMessage  # noqa: E402, F401
+from server.common.partitions import partition_month, partitioned_tables  # noqa: E402
 from server.profiles.model import *
 
 target_metadata = [Base.metadata]
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # partitions are created by migrations and the maintenance job, they aren't in the metadata
+    if type_ == "table" and reflected and compare_to is None:
+        return not any(partition_month(table, name) for table in partitioned_tables())
+    return True
+
+
 from server.config import settings
 
 config.set_main_option("sqlalchemy.url", str(settings.datastores.sqlalchemy_database_url))
@@ -48,6 +58,7 @@ def run_migrations_offline():
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -57,7 +68,7 @@ def run_migrations_offline():
 
 
 def do_run_migrations(connection):
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
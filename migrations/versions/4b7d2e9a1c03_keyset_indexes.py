@@ -0,0 +1,30 @@
+"""keyset pagination indexes
+
+Revision ID: 4b7d2e9a1c03
+Revises: 9c3e1f2a7b41
+Create Date: 2026-10-18 17:31:05.412877
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7d2e9a1c03'
+down_revision = '9c3e1f2a7b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # concurrently so existing tables stay writable, which can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_articles_updated_at_id', 'articles', ['updated_at', 'id'], unique=False, postgresql_concurrently=True
+        )
+        op.create_index('ix_profiles_name_id', 'profiles', ['name', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_profiles_name_id', table_name='profiles', postgresql_concurrently=True)
+        op.drop_index('ix_articles_updated_at_id', table_name='articles', postgresql_concurrently=True)
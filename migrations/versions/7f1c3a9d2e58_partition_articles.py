@@ -0,0 +1,94 @@
+"""partition articles by created_at
+
+The rows are copied into the partitioned table within the migration transaction. articles is held
+under an ACCESS EXCLUSIVE lock from the rename until the commit, so every read and write of articles
+waits for the whole copy. Run it in a maintenance window with the server and the workers stopped.
+
+Revision ID: 7f1c3a9d2e58
+Revises: 4b7d2e9a1c03
+Create Date: 2026-10-18 19:02:44.918203
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f1c3a9d2e58'
+down_revision = '4b7d2e9a1c03'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'title, content, profile_id, created_at, updated_at, id'
+# the month of this revision and 3 months ahead, partitions of later months are created by the maintenance job
+FIRST_MONTH = date(2026, 10, 1)
+LAST_MONTH = date(2027, 1, 1)
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _create_partitions(table, first, last):
+    # the names and bounds the maintenance job uses, kept here so the revision doesn't change with the app
+    month = first
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        )
+        month = _next_month(month)
+
+
+def _articles_table(name, *constraints, **kwargs):
+    return op.create_table(name,
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('content', sa.TEXT(), nullable=False),
+    sa.Column('profile_id', sa.Uuid(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('id', sa.Uuid(), nullable=False),
+    sa.ForeignKeyConstraint(['profile_id'], ['profiles.id'], ),
+    *constraints,
+    **kwargs
+    )
+
+
+def upgrade():
+    op.rename_table('articles', 'articles_unpartitioned')
+    op.execute('ALTER TABLE articles_unpartitioned RENAME CONSTRAINT articles_pkey TO articles_unpartitioned_pkey')
+    op.execute('ALTER INDEX ix_articles_updated_at_id RENAME TO ix_articles_unpartitioned_updated_at_id')
+    _articles_table(
+        'articles',
+        sa.PrimaryKeyConstraint('id', 'created_at', name='articles_pkey'),
+        postgresql_partition_by='RANGE (created_at)',
+    )
+    op.create_index('ix_articles_updated_at_id', 'articles', ['updated_at', 'id'], unique=False)
+    op.create_index('ix_articles_created_at', 'articles', ['created_at'], unique=False)
+
+    # the existing rows may need partitions outside the pinned range
+    oldest, newest = op.get_bind().execute(
+        sa.text('SELECT min(created_at), max(created_at) FROM articles_unpartitioned')
+    ).one()
+    first = min(_month_start(oldest.date()), FIRST_MONTH) if oldest else FIRST_MONTH
+    last = max(_month_start(newest.date()), LAST_MONTH) if newest else LAST_MONTH
+    _create_partitions('articles', first, last)
+    op.execute(f'INSERT INTO articles ({COLUMNS}) SELECT {COLUMNS} FROM articles_unpartitioned')
+    op.drop_table('articles_unpartitioned')
+
+
+def downgrade():
+    op.rename_table('articles', 'articles_partitioned')
+    op.execute('ALTER INDEX ix_articles_updated_at_id RENAME TO ix_articles_partitioned_updated_at_id')
+    op.execute('ALTER TABLE articles_partitioned RENAME CONSTRAINT articles_pkey TO articles_partitioned_pkey')
+    _articles_table('articles', sa.PrimaryKeyConstraint('id', name='articles_pkey'))
+    op.create_index('ix_articles_updated_at_id', 'articles', ['updated_at', 'id'], unique=False)
+    op.execute(f'INSERT INTO articles ({COLUMNS}) SELECT {COLUMNS} FROM articles_partitioned')
+    # drops the partitions with it
+    op.drop_table('articles_partitioned')
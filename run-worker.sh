@@ -1,2 +1,2 @@
 #!/bin/bash
-uv run arq worker.main.WorkerSettings
\ No newline at end of file
+uv run python -m worker.main ${1:-WorkerSettings}
\ No newline at end of file
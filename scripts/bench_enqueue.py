@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from arq import create_pool
+from arq.connections import RedisSettings
+from arq.constants import job_key_prefix
+
+from server.common.queue import JobName, ProcessJobData, close_queue, enqueue, enqueue_many, init_queue
+from server.config import settings
+
+
+async def per_call_pool(jobs: list[ProcessJobData], queue_name: str) -> list[str]:
+    job_ids = []
+    for job in jobs:
+        pool = await create_pool(RedisSettings.from_dsn(settings.datastores.redis_url), default_queue_name=queue_name)
+        created = await pool.enqueue_job(JobName.process_article_job, **job.model_dump())
+        job_ids.append(created.job_id)
+        await pool.close(close_connection_pool=True)
+    return job_ids
+
+
+async def shared_pool(jobs: list[ProcessJobData], queue_name: str) -> list[str]:
+    return [(await enqueue(JobName.process_article_job, job, queue_name=queue_name)).job_id for job in jobs]
+
+
+async def shared_pool_batched(jobs: list[ProcessJobData], queue_name: str) -> list[str]:
+    return [job.job_id for job in await enqueue_many(JobName.process_article_job, jobs, queue_name=queue_name)]
+
+
+async def run(count: int, queue_name: str):
+    jobs = [ProcessJobData(article_id=uuid4()) for _ in range(count)]
+    # every payload is enqueued as its own job, like the other strategies
+    settings.task.debounce_seconds = {}
+    pool = await init_queue()
+    job_ids: list[str] = []
+    try:
+        for name, bench in [
+            ("per-call pool", per_call_pool),
+            ("shared pool", shared_pool),
+            ("shared pool, enqueue_many", shared_pool_batched),
+        ]:
+            start = time.perf_counter()
+            job_ids += await bench(jobs, queue_name)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<28} {count} jobs in {elapsed:.3f}s ({elapsed / count * 1000:.3f}ms/job)")
+    finally:
+        await pool.delete(queue_name, *[job_key_prefix + job_id for job_id in job_ids])
+        await close_queue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare enqueue strategies")
+    parser.add_argument("--count", type=int, default=1000, help="jobs enqueued per strategy")
+    parser.add_argument("--queue", type=str, default="arq:bench", help="throwaway queue name")
+    args = parser.parse_args()
+    asyncio.run(run(args.count, args.queue))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import random
+import time
+
+from server.articles.model import Article, ArticleResponseData
+from server.common.database import session_manager
+from server.common.model import Loading
+from server.config import settings
+from server.profiles.model import Profile
+
+
+async def bench(article_ids: list, args: argparse.Namespace):
+    for loading in Loading:
+        async with session_manager.session() as db:
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                await Article.get(db, random.choice(article_ids), projection=ArticleResponseData, loading=loading)
+                db.expunge_all()
+            get_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                await Article.list(
+                    db,
+                    limit=args.page_size,
+                    order_by=Article.updated_at.desc(),
+                    projection=ArticleResponseData,
+                    loading=loading,
+                )
+                db.expunge_all()
+            list_elapsed = time.perf_counter() - start
+        print(
+            f"{loading.value:<10} get {get_elapsed / args.rounds * 1000:8.3f}ms "
+            f"list of {args.page_size} {list_elapsed / args.rounds * 1000:8.3f}ms"
+        )
+
+
+async def run(args: argparse.Namespace):
+    session_manager.init(settings.datastores.sqlalchemy_database_url, datastores=settings.datastores)
+    try:
+        async with session_manager.session() as db:
+            profiles = await Profile.bulk_create(db, [{"name": f"bench-loading {i}"} for i in range(args.profiles)])
+            articles = await Article.bulk_create(
+                db,
+                [
+                    {"title": f"article {i}", "content": "x", "profile_id": profiles[i % len(profiles)].id}
+                    for i in range(args.articles)
+                ],
+            )
+        profile_ids = [profile.id for profile in profiles]
+        try:
+            await bench([article.id for article in articles], args)
+        finally:
+            await Article.delete_where_batched(Article.profile_id.in_(profile_ids))
+            await Profile.delete_where_batched(Profile.id.in_(profile_ids))
+    finally:
+        await session_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare relationship loading strategies of article gets and pages")
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--profiles", type=int, default=20, help="profiles the articles are spread over")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=500, help="gets and lists per strategy")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
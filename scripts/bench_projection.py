@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from sqlalchemy import inspect
+
+from server.articles.model import Article, ArticleResponseData
+from server.common.database import session_manager
+from server.config import settings
+from server.profiles.model import Profile
+
+
+def loaded_bytes(articles: list[Article]) -> int:
+    """Size of the string values hydrated into the entities, roughly what came over the wire."""
+    total = 0
+    for article in articles:
+        for entity in (article, *([article.profile] if "profile" not in inspect(article).unloaded else [])):
+            total += sum(len(value) for value in inspect(entity).dict.values() if isinstance(value, str))
+    return total
+
+
+async def bench(profile: Profile, count: int, rounds: int):
+    for name, projection in [("full entities", None), ("ArticleResponseData projection", ArticleResponseData)]:
+        elapsed, peak, size = 0.0, 0, 0
+        for _ in range(rounds):
+            async with session_manager.session() as db:
+                tracemalloc.start()
+                start = time.perf_counter()
+                articles = await Article.list(db, filter=Article.profile_id == profile.id, projection=projection)
+                elapsed += time.perf_counter() - start
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                size = loaded_bytes(articles)
+        print(
+            f"{name:<32} {elapsed / rounds * 1000:9.1f}ms/list {peak / 1024 / 1024:9.1f}MiB peak "
+            f"{size / 1024 / 1024:9.1f}MiB loaded ({len(articles)} articles)"
+        )
+
+
+async def run(args: argparse.Namespace):
+    session_manager.init(settings.datastores.sqlalchemy_database_url, datastores=settings.datastores)
+    content = "x" * (args.content_kb * 1024)
+    try:
+        async with session_manager.session() as db:
+            profile = Profile(name="bench-projection")
+            await profile.save(db)
+            await Article.bulk_create(
+                db, [{"title": f"article {i}", "content": content, "profile_id": profile.id} for i in range(args.count)]
+            )
+        try:
+            await bench(profile, args.count, args.rounds)
+        finally:
+            await Article.delete_where_batched(Article.profile_id == profile.id)
+            async with session_manager.session() as db:
+                await Profile.delete(db, profile.id)
+    finally:
+        await session_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare listing full articles with the response model projection")
+    parser.add_argument("--count", type=int, default=500, help="articles listed")
+    parser.add_argument("--content-kb", type=int, default=64, help="size of every article body")
+    parser.add_argument("--rounds", type=int, default=5, help="lists per variant")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
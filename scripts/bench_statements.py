@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from server.articles.model import Article
+from server.common.database import session_manager
+from server.common.query_stats import DB_COMPILED_CACHE
+from server.config import settings
+
+
+def bench_cache_keys(count: int):
+    """Statement construction and cache key generation only, no database."""
+    ids = [uuid4() for _ in range(count)]
+    for name, build in [
+        ("fresh get_query", lambda entity_id: Article.get_query(entity_id)),
+        ("prebuilt get_by_id_statement", lambda _: Article.get_by_id_statement()),
+        ("fresh list_query_for_profile", lambda profile_id: Article.list_query_for_profile(profile_id)),
+    ]:
+        start = time.perf_counter()
+        for entity_id in ids:
+            build(entity_id)._generate_cache_key()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<32} {elapsed / count * 1_000_000:8.1f}us/call (build + cache key)")
+
+
+async def bench_execute(count: int):
+    async def fresh(db, entity_id):
+        await db.execute(Article.get_query(entity_id))
+
+    async def prebuilt(db, entity_id):
+        await db.execute(Article.get_by_id_statement(), {"entity_id": entity_id})
+
+    async def for_profile(db, profile_id):
+        await Article.list_for_profile(db, profile_id)
+
+    benches: list[tuple[str, Callable[..., Awaitable]]] = [
+        ("fresh get_query", fresh),
+        ("prebuilt get_by_id_statement", prebuilt),
+        ("prebuilt list_for_profile", for_profile),
+    ]
+    async with session_manager.session() as db:
+        for name, bench in benches:
+            # warm up the connection and the compiled cache
+            await bench(db, uuid4())
+            before = dict(DB_COMPILED_CACHE.values)
+            start = time.perf_counter()
+            for _ in range(count):
+                await bench(db, uuid4())
+            elapsed = time.perf_counter() - start
+            hits = DB_COMPILED_CACHE.values.get(("hit",), 0) - before.get(("hit",), 0)
+            total = sum(DB_COMPILED_CACHE.values.values()) - sum(before.values())
+            print(f"{name:<32} {elapsed / count * 1000:8.3f}ms/call (execute), compiled cache hits {hits / total:.1%}")
+
+
+async def run(count: int):
+    bench_cache_keys(count)
+    session_manager.init(settings.datastores.sqlalchemy_database_url, datastores=settings.datastores)
+    try:
+        await bench_execute(count)
+    finally:
+        await session_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fresh and prebuilt entity statements")
+    parser.add_argument("--count", type=int, default=5000, help="calls per variant")
+    args = parser.parse_args()
+    asyncio.run(run(args.count))
+
+
+if __name__ == "__main__":
+    main()
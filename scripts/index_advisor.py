@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import re
+from collections import defaultdict
+from typing import Any, Iterator
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from server.common.database import session_manager
+from server.common.redis import close_redis
+from server.common.slow_queries import list_plans
+from server.config import settings
+
+TOP_STATEMENTS = text(
+    "SELECT query, calls, total_exec_time, mean_exec_time FROM pg_stat_statements "
+    "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+    "ORDER BY total_exec_time DESC LIMIT :limit"
+)
+TABLE_SCANS = text(
+    "SELECT relname, seq_scan, seq_tup_read, coalesce(idx_scan, 0), n_live_tup FROM pg_stat_user_tables "
+    "ORDER BY seq_tup_read DESC"
+)
+COLUMNS = text("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()")
+# leading column of every index, an index only helps a filter on its first column
+INDEXED = text(
+    "SELECT t.relname, a.attname FROM pg_index i "
+    "JOIN pg_class t ON t.oid = i.indrelid "
+    "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0] "
+    "JOIN pg_namespace n ON n.oid = t.relnamespace WHERE n.nspname = current_schema()"
+)
+# partitions report their own statistics and plans, indexes belong on the partitioned table so new partitions get them
+PARTITIONS = text(
+    "SELECT c.relname, p.relname FROM pg_inherits i "
+    "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = current_schema() AND p.relkind = 'p'"
+)
+IDENTIFIER = re.compile(r"[a-z_][a-z0-9_]*")
+
+
+def _walk(node: dict) -> Iterator[tuple[dict, dict | None]]:
+    yield node, None
+    for child in node.get("Plans", []):
+        for descendant, parent in _walk(child):
+            yield descendant, parent or node
+
+
+def _root(table: str, parents: dict[str, str]) -> str:
+    while table in parents:
+        table = parents[table]
+    return table
+
+
+def _columns(expression: str, table_columns: set[str]) -> list[str]:
+    return list(dict.fromkeys(name for name in IDENTIFIER.findall(expression) if name in table_columns))
+
+
+def _seq_scans(plan: Any, columns: dict[str, set[str]]) -> Iterator[tuple[str, list[str], str, int]]:
+    """Sequential scans with a filter or feeding a sort: (table, candidate columns, reason, rows removed)."""
+    roots = plan if isinstance(plan, list) else [plan]
+    for root in roots:
+        for node, parent in _walk(root["Plan"]):
+            if node.get("Node Type") != "Seq Scan":
+                continue
+            table = node["Relation Name"]
+            if "Filter" in node:
+                found = _columns(node["Filter"], columns.get(table, set()))
+                yield table, found, f"filter {node['Filter']}", node.get("Rows Removed by Filter", 0)
+            if parent is not None and parent.get("Node Type") in ("Sort", "Incremental Sort"):
+                keys = " ".join(parent.get("Sort Key", []))
+                yield table, _columns(keys, columns.get(table, set())), f"sort by {keys}", 0
+
+
+async def run(args: argparse.Namespace):
+    session_manager.init(settings.datastores.sqlalchemy_database_url, datastores=settings.datastores)
+    try:
+        async with session_manager.connect() as connection:
+            columns: dict[str, set[str]] = defaultdict(set)
+            for table, column in await connection.execute(COLUMNS):
+                columns[table].add(column)
+            indexed = {(table, column) for table, column in await connection.execute(INDEXED)}
+            parents = {partition: parent for partition, parent in await connection.execute(PARTITIONS)}
+
+            print("== statements by total time (pg_stat_statements)")
+            try:
+                async with connection.begin_nested():
+                    for query, calls, total, mean in await connection.execute(TOP_STATEMENTS, {"limit": args.limit}):
+                        print(
+                            f"{total:12.1f}ms total {mean:9.2f}ms mean {calls:9} calls  {' '.join(query.split())[:160]}"
+                        )
+            except DBAPIError:
+                print("pg_stat_statements is not available, add it to shared_preload_libraries and run")
+                print("CREATE EXTENSION pg_stat_statements;")
+
+            print("\n== tables by rows read sequentially (pg_stat_user_tables, partitions summed up)")
+            scans: dict[str, list[int]] = {}
+            for table, *counts in await connection.execute(TABLE_SCANS):
+                totals = scans.setdefault(_root(table, parents), [0] * len(counts))
+                for i, count in enumerate(counts):
+                    totals[i] += count
+            for table, (seq_scan, seq_read, idx_scan, live) in sorted(scans.items(), key=lambda item: -item[1][1]):
+                print(
+                    f"{table:30} {seq_scan:9} seq scans {seq_read:12} rows read {idx_scan:9} index scans {live:10} rows"
+                )
+
+        print("\n== sequential scans in captured slow query plans")
+        suggestions: dict[tuple[str, str], list[str]] = defaultdict(list)
+        for plan in await list_plans():
+            for table, candidates, reason, removed in _seq_scans(plan.plan, columns):
+                table = _root(table, parents)
+                print(f"{table:30} {reason[:120]} ({removed} rows removed, {plan.duration:.3f}s in {plan.source})")
+                for column in candidates:
+                    if (table, column) not in indexed:
+                        suggestions[(table, column)].append(plan.source)
+
+        print("\n== index candidates")
+        if not suggestions:
+            print("none, capture plans with DATASTORES__SLOW_QUERY_EXPLAIN_SAMPLE_RATE")
+        for (table, column), sources in sorted(suggestions.items(), key=lambda item: -len(item[1])):
+            statement = f"CREATE INDEX ix_{table}_{column} ON {table} ({column});"
+            print(f"{statement}  -- {len(sources)} plans: {sorted(set(sources))}")
+    finally:
+        await session_manager.close()
+        await close_redis()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report sequential scans on hot filters and suggest indexes")
+    parser.add_argument("--limit", type=int, default=20, help="number of statements from pg_stat_statements")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import argparse
+import asyncio
+
+from server.common.dead_letter import list_dead_letters, replay_dead_letters
+from server.common.queue import JobName, close_queue
+from server.common.redis import close_redis
+
+
+async def run(args: argparse.Namespace):
+    try:
+        if args.list:
+            for dead_letter in await list_dead_letters(args.job_name, args.limit or 100):
+                print(f"{dead_letter.failed_at} {dead_letter.id} tries={dead_letter.tries} {dead_letter.payload}")
+                print(dead_letter.error)
+        else:
+            replayed = await replay_dead_letters(args.job_name, args.limit, args.rate)
+            print(f"replayed {replayed} {args.job_name} jobs")
+    finally:
+        await close_queue()
+        await close_redis()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay dead-lettered jobs")
+    parser.add_argument("job_name", type=JobName, choices=list(JobName), help="job to replay")
+    parser.add_argument("--limit", type=int, default=None, help="maximum number of jobs, all by default")
+    parser.add_argument("--rate", type=float, default=None, help="jobs per second")
+    parser.add_argument("--list", action="store_true", help="only print the oldest dead letters")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+from server.common.queue import JobName
+
+
+class ReplayDeadLettersData(BaseModel):
+    job_name: JobName
+    limit: int | None = None
+    rate: float | None = None
+
+
+class ReplayDeadLettersResponseData(BaseModel):
+    job_name: JobName
+    pending: int
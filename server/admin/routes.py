@@ -0,0 +1,35 @@
+import hmac
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, Query
+
+from server.admin.model import ReplayDeadLettersData, ReplayDeadLettersResponseData
+from server.common.dead_letter import DeadLetter, count_dead_letters, list_dead_letters, replay_dead_letters
+from server.common.exceptions import not_found, unauthorized
+from server.common.http import DataResponse
+from server.common.logging import LoggingRoute
+from server.common.queue import JobName
+from server.config import settings
+
+
+async def require_admin(x_admin_token: str | None = Header(None)):
+    if settings.admin_token is None:
+        raise not_found("Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), settings.admin_token.encode()):
+        raise unauthorized("Invalid admin token")
+
+
+router = APIRouter(route_class=LoggingRoute, dependencies=[Depends(require_admin)])
+
+
+@router.get("/dead-letters", response_model=DataResponse[list[DeadLetter]])
+async def get_dead_letters(job_name: JobName, limit: int = Query(100, ge=1, le=1000)):
+    return DataResponse(data=await list_dead_letters(job_name, limit))
+
+
+@router.post("/dead-letters/replay", response_model=DataResponse[ReplayDeadLettersResponseData])
+async def replay(data: ReplayDeadLettersData, background_tasks: BackgroundTasks):
+    pending = await count_dead_letters(data.job_name)
+    if data.limit is not None:
+        pending = min(pending, data.limit)
+    background_tasks.add_task(replay_dead_letters, data.job_name, data.limit, data.rate)
+    return DataResponse(data=ReplayDeadLettersResponseData(job_name=data.job_name, pending=pending))
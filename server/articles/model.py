@@ -1,16 +1,22 @@
 from uuid import UUID
 
 from pydantic import BaseModel
+from sqlalchemy import Index
 from sqlalchemy.dialects.postgresql import TEXT
 from sqlalchemy.orm import Mapped, mapped_column
 
 from server.common.database import Base
-from server.common.model import EntityMixin, TemporalMixin
+from server.common.model import EntityMixin, PartitionedMixin, partitioned_table_args
 from server.profiles.model import ProfileRelatedEntity, ProfileResponseData
 
 
-class Article(ProfileRelatedEntity, TemporalMixin, EntityMixin, Base):
+class Article(ProfileRelatedEntity, PartitionedMixin, EntityMixin, Base):
     __tablename__ = "articles"
+    __table_args__ = partitioned_table_args(
+        # keyset pagination order
+        Index("ix_articles_updated_at_id", "updated_at", "id"),
+        Index("ix_articles_created_at", "created_at"),
+    )
 
     title: Mapped[str] = mapped_column(nullable=False)
     content: Mapped[str] = mapped_column(type_=TEXT, nullable=False)
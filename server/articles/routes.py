@@ -1,36 +1,95 @@
-from fastapi import APIRouter, Depends
+from typing import AsyncIterator
+from uuid import UUID
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi_pagination.bases import AbstractPage
-from fastapi_pagination.ext.sqlalchemy import paginate
 
 from server.articles.model import Article, ArticleCreateData, ArticleResponseData
-from server.common.database import DB, transactional
+from server.common.database import DB, ReadDB, session_manager, transactional
 from server.common.exceptions import not_found
-from server.common.http import DataResponse, PageDataResponse, Params
+from server.common.http import (
+    CursorPageDataResponse,
+    CursorParams,
+    DataResponse,
+    PageDataResponse,
+    Params,
+    TotalStrategy,
+)
 from server.common.logging import LoggingRoute
-from server.common.queue import JobName, ProcessJobData, enqueue
+from server.common.model import Loading
+from server.common.outbox import add_to_outbox
+from server.common.pagination import paginate, paginate_keyset
+from server.common.query_stats import query_budget
+from server.common.queue import JobName, ProcessJobData
+from server.common.response_cache import cached_response
 from server.profiles.model import Profile
 
 router = APIRouter(route_class=LoggingRoute)
 
 
 @router.get("", response_model=PageDataResponse[ArticleResponseData])
+@cached_response(PageDataResponse[ArticleResponseData], [Article, Profile])
+@query_budget(2)
 @transactional
-async def list_articles(params: Params = Depends(), db: DB = Depends()) -> AbstractPage[Article]:
+async def list_articles(params: Params = Depends(), db: ReadDB = Depends()) -> AbstractPage[Article]:
     return await paginate(
         db,
-        Article.list_query(order_by=Article.updated_at.desc()),
+        Article.list_query(order_by=Article.updated_at.desc(), projection=ArticleResponseData, loading=Loading.joined),
+        params,
+        total=TotalStrategy.cached,
+    )
+
+
+@router.get("/cursor", response_model=CursorPageDataResponse[ArticleResponseData])
+@query_budget(1)
+@transactional
+async def list_articles_by_cursor(
+    params: CursorParams = Depends(), db: ReadDB = Depends()
+) -> CursorPageDataResponse[Article]:
+    return await paginate_keyset(
+        db,
+        Article.list_query(projection=ArticleResponseData, loading=Loading.joined),
         params,
+        [Article.updated_at, Article.id],
+        descending=True,
     )
 
 
+async def _export_lines(profile_id: UUID | None) -> AsyncIterator[bytes]:
+    async with session_manager.read_session() as db:
+        filter = None if profile_id is None else Article.profile_id == profile_id
+        # selectin loading of a many-to-one relationship can't be combined with yield_per
+        articles = Article.stream(
+            db, filter, order_by=Article.created_at, projection=ArticleResponseData, loading=Loading.joined
+        )
+        async for article in articles:
+            yield orjson.dumps(ArticleResponseData.model_validate(article, from_attributes=True).model_dump()) + b"\n"
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_articles(profile_id: UUID | None = None) -> StreamingResponse:
+    """Articles as newline delimited JSON, read and sent a row at a time.
+
+    Every line waits for the previous one to be sent, so a slow client slows the cursor down
+    instead of the rows piling up in memory.
+    """
+    return StreamingResponse(_export_lines(profile_id), media_type="application/x-ndjson")
+
+
 @router.post("", response_model=DataResponse[ArticleResponseData])
+@query_budget(3)
 @transactional
 async def create_article(data: ArticleCreateData, db: DB = Depends()) -> Article:
-    exists = await Profile.exists(db, Profile.id == data.profile_id)
-    if not exists:
+    # load the profile instead of checking it exists so the response doesn't need another query,
+    # it's usually answered by the entity cache
+    try:
+        profile = await Profile.get(db, data.profile_id)
+    except HTTPException:
         raise not_found(f"Profile {data.profile_id} not found")
     article = Article(title=data.title, content=data.content, profile_id=data.profile_id)
+    article.profile = profile
+    add_to_outbox(db, JobName.process_article_job, ProcessJobData(article_id=article.id, profile_id=article.profile_id))
     await article.save(db)
-    await enqueue(JobName.process_article_job, ProcessJobData(article_id=article.id))
-    await article.awaitable_attrs.profile
     return article
@@ -0,0 +1,114 @@
+"""Tables written by committed transactions, for invalidating data cached outside the database.
+
+Every table gets a generation counter in redis that is bumped after each commit writing to it,
+cache entries derived from a table store or key on its generation and are stale once it moves.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Coroutine, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session, UOWTransaction
+
+from server.common.metrics import REDIS_COMMAND_DURATION
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "table-generation:{}"
+
+TablesListener = Callable[[set[str]], Awaitable[None]]
+
+_listeners: list[TablesListener] = []
+# keeps the notification tasks referenced until they finish
+_notifications: set[asyncio.Task] = set()
+
+
+def on_tables_changed(listener: TablesListener) -> TablesListener:
+    """Register a coroutine called with the tables written by every committed transaction."""
+    _listeners.append(listener)
+    return listener
+
+
+async def table_generations(tables: Iterable[str]) -> list[int]:
+    tables = list(tables)
+    if not tables:
+        return []
+    with REDIS_COMMAND_DURATION.time(op="table_generations"):
+        values = await get_redis().mget([GENERATION_KEY.format(table) for table in tables])
+    return [int(value or 0) for value in values]
+
+
+@on_tables_changed
+async def bump_generations(tables: set[str]):
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for table in tables:
+            pipe.incr(GENERATION_KEY.format(table))
+        with REDIS_COMMAND_DURATION.time(op="bump_generations"):
+            await asyncio.wait_for(pipe.execute(), settings.cache.invalidation_timeout_seconds)
+
+
+async def _notify(tables: set[str]):
+    for listener in _listeners:
+        try:
+            await listener(tables)
+        except Exception:
+            logger.exception(f"unable to notify {listener.__name__} of changes to {tables}")
+
+
+def _changed_tables(session: Session) -> set[str]:
+    return session.info.setdefault("changed_tables", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session: Session, flush_context: UOWTransaction):
+    for entity in [*session.new, *session.dirty, *session.deleted]:
+        table = getattr(entity, "__tablename__", None)
+        if table is not None:
+            _changed_tables(session).add(table)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(state: ORMExecuteState):
+    # bulk INSERT / UPDATE / DELETE statements bypass the flush
+    if (state.is_insert or state.is_update or state.is_delete) and state.bind_mapper is not None:
+        _changed_tables(state.session).add(state.bind_mapper.local_table.name)  # type: ignore
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    tables = session.info.pop("changed_tables", None)
+    if tables and _listeners:
+        notify_after_commit(session, _notify(tables))
+
+
+def notify_after_commit(session: Session, notification: Coroutine):
+    """Run a coroutine telling caches about a commit of the session, `notified` waits for it."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        notification.close()
+        return
+    task = loop.create_task(notification)
+    _notifications.add(task)
+    task.add_done_callback(_notifications.discard)
+    session.info.setdefault("pending_notifications", []).append(task)
+
+
+async def notified(session: AsyncSession):
+    """Wait until the listeners handled the session's commits, so no cache serves what they replaced."""
+    tasks = session.info.pop("pending_notifications", None)
+    if not tasks:
+        return
+    # unfinished notifications keep running, the response just doesn't wait for them any longer
+    _, pending = await asyncio.wait(tasks, timeout=settings.cache.invalidation_timeout_seconds)
+    if pending:
+        logger.warning(f"{len(pending)} cache notifications still running after the commit, not waiting for them")
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop("changed_tables", None)
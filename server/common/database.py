@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import contextlib
 import functools
 import logging
-from dataclasses import asdict, is_dataclass
-from typing import AsyncIterator
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields, is_dataclass
+from typing import AsyncIterator, Sequence
 
 from fastapi import Depends, Response
 from fastapi_pagination.bases import AbstractPage
+from sqlalchemy import exc, inspect, text
 from sqlalchemy.ext.asyncio import (
     AsyncAttrs,
     AsyncConnection,
@@ -18,10 +22,16 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass
 from sqlalchemy.orm.base import DEFAULT_STATE_ATTR
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
 
+from server.common import changes  # noqa: F401  registers the session change tracking
 from server.common.exceptions import not_found
 from server.common.fastapi import find_fastapi_param_name
 from server.common.http import DataResponse
+from server.common.metrics import REGISTRY, Counter, Gauge, Histogram
+from server.common.query_stats import instrument_engine
+from server.common.slow_queries import record_slow_queries
+from server.config import Datastores
 
 logger = logging.getLogger(__name__)
 
@@ -30,21 +40,142 @@ class Base(MappedAsDataclass, AsyncAttrs, DeclarativeBase):
     pass
 
 
+DB_POOL_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_duration_seconds", "Time spent waiting for a pooled (or a newly opened) database connection"
+)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Database connection checkouts that timed out")
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait and how often they time out."""
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_DURATION.observe(time.perf_counter() - start)
+
+
+def _engine_options(datastores: Datastores) -> dict:
+    connect_args: dict = {"prepared_statement_cache_size": datastores.db_statement_cache_size}
+    if datastores.db_pgbouncer:
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": datastores.db_pool_size,
+        "max_overflow": datastores.db_max_overflow,
+        "pool_timeout": datastores.db_pool_timeout_seconds,
+        "pool_recycle": datastores.db_pool_recycle_seconds,
+        "pool_pre_ping": datastores.db_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
+
+# seconds since the last replayed transaction, 0 when the replica replayed everything it received
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def _sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(engine, expire_on_commit=False, future=True, class_=AsyncSession)
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker[AsyncSession]
+    # replicas are only used once a health check passed
+    healthy: bool = False
+    lag: float | None = None
+    outstanding: int = 0
+
+
 class DatabaseSessionManager:
     def __init__(self):
         self._engine: AsyncEngine | None = None
         self._sessionmaker: async_sessionmaker[AsyncSession] | None = None
+        self._replicas: list[Replica] = []
+        self._next_replica = 0
+        self._datastores = Datastores()
+
+    def init(
+        self, url: str, debug: bool = False, datastores: Datastores | None = None, replica_urls: Sequence[str] = ()
+    ):
+        self._datastores = datastores or Datastores()
+        options = _engine_options(self._datastores)
+        self._engine = create_async_engine(url, echo=debug, **options)
+        instrument_engine(self._engine)
+        record_slow_queries(self._engine)
+        self._sessionmaker = _sessionmaker(self._engine)
+        self._replicas = []
+        for i, replica_url in enumerate(replica_urls):
+            engine = create_async_engine(replica_url, echo=debug, **options)
+            instrument_engine(engine)
+            record_slow_queries(engine)
+            self._replicas.append(Replica(name=f"replica{i}", engine=engine, sessionmaker=_sessionmaker(engine)))
+
+    def _pick_replica(self) -> Replica | None:
+        replicas = [replica for replica in self._replicas if replica.healthy]
+        if not replicas:
+            return None
+        # rotate the candidates so least outstanding ties are spread as well
+        start = self._next_replica % len(replicas)
+        self._next_replica += 1
+        replicas = replicas[start:] + replicas[:start]
+        if self._datastores.replica_balancing == "round_robin":
+            return replicas[0]
+        return min(replicas, key=lambda replica: replica.outstanding)
 
-    def init(self, url: str, debug: bool = False):
-        self._engine = create_async_engine(url, echo=debug)
-        self._sessionmaker = async_sessionmaker(self._engine, expire_on_commit=False, future=True, class_=AsyncSession)
+    async def check_replicas(self):
+        await asyncio.gather(*[self._check_replica(replica) for replica in self._replicas])
+
+    async def _check_replica(self, replica: Replica):
+        try:
+            lag = await asyncio.wait_for(self._replica_lag(replica), self._datastores.replica_check_interval_seconds)
+        except Exception as e:
+            if replica.healthy:
+                logger.warning(f"{replica.name} failed its health check, reads fall back to the primary: {e}")
+            replica.healthy, replica.lag = False, None
+            return
+        healthy = lag <= self._datastores.replica_max_lag_seconds
+        if healthy != replica.healthy:
+            logger.info(f"{replica.name} is {'healthy' if healthy else 'lagging'} (lag {lag:.1f}s)")
+        replica.healthy, replica.lag = healthy, lag
+
+    @staticmethod
+    def lagging(session: AsyncSession) -> bool:
+        """Whether the session reads from a replica that was behind the primary at its last check."""
+        return bool(session.info.get("replica_lag"))
+
+    async def _replica_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as connection:
+            return float((await connection.execute(REPLICA_LAG_QUERY)).scalar_one())
+
+    async def monitor_replicas(self):
+        while True:
+            await self.check_replicas()
+            await asyncio.sleep(self._datastores.replica_check_interval_seconds)
 
     async def close(self):
         if self._engine is None:
             raise Exception("DatabaseSessionManager is not initialized")
         await self._engine.dispose()
+        for replica in self._replicas:
+            await replica.engine.dispose()
         self._engine = None
         self._sessionmaker = None
+        self._replicas = []
 
     @contextlib.asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
@@ -61,10 +192,32 @@ class DatabaseSessionManager:
     async def session(self) -> AsyncIterator[AsyncSession]:
         if self._sessionmaker is None:
             raise Exception("DatabaseSessionManager is not initialized")
-        session = self._sessionmaker()
+        async with self._session(self._sessionmaker) as session:
+            yield session
+
+    @contextlib.asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        """Session on a healthy replica, or on the primary when there is none."""
+        replica = self._pick_replica()
+        if replica is None:
+            async with self.session() as session:
+                yield session
+            return
+        replica.outstanding += 1
+        try:
+            async with self._session(replica.sessionmaker) as session:
+                session.info["replica_lag"] = replica.lag
+                yield session
+        finally:
+            replica.outstanding -= 1
+
+    @contextlib.asynccontextmanager
+    async def _session(self, sessionmaker: async_sessionmaker[AsyncSession]) -> AsyncIterator[AsyncSession]:
+        session = sessionmaker()
         try:
             yield session
             await session.commit()
+            await changes.notified(session)
         except Exception:
             await session.rollback()
             raise
@@ -81,6 +234,32 @@ class DatabaseSessionManager:
 
 session_manager = DatabaseSessionManager()
 
+DB_POOL_SIZE = Gauge("db_pool_size", "Configured size of the database connection pool", ["engine"])
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Database connections currently checked out", ["engine"])
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Database connections opened over the pool size", ["engine"])
+DB_REPLICA_HEALTHY = Gauge("db_replica_healthy", "Whether a read replica receives reads", ["replica"])
+DB_REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replication lag of a read replica", ["replica"])
+DB_REPLICA_OUTSTANDING = Gauge("db_replica_outstanding_sessions", "Open sessions on a read replica", ["replica"])
+
+
+def _collect_pool(engine: AsyncEngine, name: str):
+    pool = engine.pool
+    DB_POOL_SIZE.set(pool.size(), engine=name)  # type: ignore
+    DB_POOL_CHECKED_OUT.set(pool.checkedout(), engine=name)  # type: ignore
+    DB_POOL_OVERFLOW.set(max(pool.overflow(), 0), engine=name)  # type: ignore
+
+
+@REGISTRY.collector
+def collect_pool_metrics():
+    if session_manager._engine is None:
+        return
+    _collect_pool(session_manager._engine, "primary")
+    for replica in session_manager._replicas:
+        _collect_pool(replica.engine, replica.name)
+        DB_REPLICA_HEALTHY.set(replica.healthy, replica=replica.name)
+        DB_REPLICA_LAG.set(-1 if replica.lag is None else replica.lag, replica=replica.name)
+        DB_REPLICA_OUTSTANDING.set(replica.outstanding, replica=replica.name)
+
 
 async def get_db() -> AsyncIterator[AsyncSession]:
     async with session_manager.session() as session:
@@ -95,14 +274,36 @@ class DB(AsyncSession):
         return db
 
 
+async def get_read_db() -> AsyncIterator[AsyncSession]:
+    async with session_manager.read_session() as session:
+        yield session
+
+
+class ReadDB(AsyncSession):
+    """Session for handlers that only read, served by a replica when one is configured and healthy."""
+
+    def __new__(cls, db: AsyncSession = Depends(get_read_db)) -> AsyncSession:
+        return db
+
+
 def _dataclass_to_dict(data):
+    if hasattr(data, DEFAULT_STATE_ATTR):
+        # columns and relationships a query didn't load are left out instead of loaded one by one
+        unloaded = inspect(data).unloaded
+        return {
+            field.name: _dataclass_to_dict(getattr(data, field.name))
+            for field in fields(data)
+            if field.name not in unloaded
+        }
+    if isinstance(data, list):
+        return [_dataclass_to_dict(item) for item in data]
     if is_dataclass(data):
         return asdict(data)  # type: ignore
     return data
 
 
 def transactional(handler):
-    db_param_name = find_fastapi_param_name(handler, DB)
+    db_param_name = find_fastapi_param_name(handler, DB, ReadDB)
 
     @functools.wraps(handler)
     async def wrapped(*args, **kwargs):
@@ -110,9 +311,12 @@ def transactional(handler):
         try:
             data = await handler(*args, **kwargs)
             await db.commit()
+            # a request following this one mustn't get a cached response from before the write
+            await changes.notified(db)
+            # sessions don't expire on commit, only attributes the flush couldn't return need a reload
+            if hasattr(data, DEFAULT_STATE_ATTR) and (expired := inspect(data).expired_attributes):
+                await db.refresh(data, expired)
             data = _dataclass_to_dict(data)
-            if hasattr(data, DEFAULT_STATE_ATTR):
-                await db.refresh(data)
             if data is None:
                 raise not_found("object not found")
             if isinstance(data, AbstractPage):
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import orjson
+from pydantic import BaseModel, ValidationError
+
+from server.common.metrics import REDIS_COMMAND_DURATION, Counter
+from server.common.queue import JOB_DATA, JobName, enqueue_many
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTERS = Counter("job_dead_letters_total", "Jobs moved to the dead-letter store", ["job"])
+DEAD_LETTERS_REPLAYED = Counter("job_dead_letters_replayed_total", "Dead letters enqueued again", ["job"])
+
+
+class DeadLetter(BaseModel):
+    id: str
+    job_name: JobName
+    payload: dict
+    error: str
+    tries: int
+    failed_at: datetime
+
+
+def _dead_letters_key(job_name: JobName) -> str:
+    return f"arq:dead-letters:{job_name}"
+
+
+def _dead_letters_index_key(job_name: JobName) -> str:
+    return f"arq:dead-letters-index:{job_name}"
+
+
+async def add_dead_letter(job_name: JobName, payload: dict, error: str, tries: int) -> DeadLetter:
+    dead_letter = DeadLetter(
+        id=uuid4().hex,
+        job_name=job_name,
+        payload=payload,
+        error=error,
+        tries=tries,
+        failed_at=datetime.now(timezone.utc),
+    )
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.hset(_dead_letters_key(job_name), dead_letter.id, dead_letter.model_dump_json())
+        pipe.zadd(_dead_letters_index_key(job_name), {dead_letter.id: dead_letter.failed_at.timestamp()})
+        with REDIS_COMMAND_DURATION.time(op="dead_letter_add"):
+            await pipe.execute()
+    DEAD_LETTERS.inc(job=job_name)
+    return dead_letter
+
+
+async def count_dead_letters(job_name: JobName) -> int:
+    return await get_redis().zcard(_dead_letters_index_key(job_name))
+
+
+async def list_dead_letters(job_name: JobName, limit: int = 100) -> list[DeadLetter]:
+    redis = get_redis()
+    ids = await redis.zrange(_dead_letters_index_key(job_name), 0, limit - 1)
+    if not ids:
+        return []
+    raw = await redis.hmget(_dead_letters_key(job_name), ids)
+    return [DeadLetter.model_validate_json(item) for item in raw if item is not None]
+
+
+async def replay_dead_letters(job_name: JobName, limit: int | None = None, rate: float | None = None) -> int:
+    """Re-enqueue the oldest dead letters of a job, at most `rate` jobs per second.
+
+    Dead letters are only removed once they are enqueued, so none is lost if enqueueing fails. Concurrent
+    replays of the same job may enqueue a dead letter twice. Dead letters whose payload no longer validates
+    are left in place.
+    """
+    redis = get_redis()
+    rate = rate or settings.task.dead_letter_replay_rate
+    chunk = max(1, math.ceil(rate))
+    replayed = skipped = 0
+    while limit is None or replayed < limit:
+        start = time.perf_counter()
+        count = chunk if limit is None else min(chunk, limit - replayed)
+        ids = await redis.zrange(_dead_letters_index_key(job_name), skipped, skipped + count - 1)
+        if not ids:
+            break
+        raw = await redis.hmget(_dead_letters_key(job_name), ids)
+        valid, jobs = [], []
+        for dead_letter_id, item in zip(ids, raw):
+            try:
+                job_data = JOB_DATA[job_name].model_validate(orjson.loads(item)["payload"]) if item else None
+            except ValidationError:
+                logger.warning(f"Skipping dead letter {dead_letter_id.decode()} of {job_name}, its payload is invalid")
+                skipped += 1
+                continue
+            valid.append(dead_letter_id)
+            if job_data is not None:
+                jobs.append(job_data)
+        await enqueue_many(job_name, jobs)
+        if valid:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(_dead_letters_index_key(job_name), *valid)
+                pipe.hdel(_dead_letters_key(job_name), *valid)
+                await pipe.execute()
+        replayed += len(jobs)
+        DEAD_LETTERS_REPLAYED.inc(len(jobs), job=job_name)
+        await asyncio.sleep(max(0.0, len(ids) / rate - (time.perf_counter() - start)))
+    return replayed
@@ -0,0 +1,243 @@
+"""Entities of models with `__entity_cache__` cached by id, in process and in redis.
+
+Committed writes bump the versions of the changed entities, delete their redis entries and publish
+their ids, every process drops its own copies when the message arrives. A reader stores what it loaded
+only if the version is still the one it read before the query, and a redis entry of an older version
+isn't served, so a reader racing a writer can't bring the old values back.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Iterable, Type, TypeVar
+from uuid import UUID
+
+import orjson
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, UOWTransaction, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+
+from server.common.changes import notify_after_commit
+from server.common.metrics import REDIS_COMMAND_DURATION, Counter
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+ENTITY_KEY = "entity-cache:{}:{}"
+VERSION_KEY = "entity-version:{}:{}"
+INVALIDATION_CHANNEL = "entity-cache:invalidate"
+
+# sets the entry unless the version changed since the reader read it
+_STORE_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+ENTITY_CACHE_LOOKUPS = Counter(
+    "entity_cache_lookups_total", "Cached entity lookups by the tier answering", ["table", "tier"]
+)
+
+EntityT = TypeVar("EntityT")
+
+_local: TTLCache = TTLCache(maxsize=settings.cache.entity_local_max_size, ttl=settings.cache.entity_local_ttl_seconds)
+
+
+def is_cached(cls: type) -> bool:
+    return getattr(cls, "__entity_cache__", False)
+
+
+def _dump(entity: Any) -> dict[str, Any]:
+    return {attr.key: getattr(entity, attr.key) for attr in entity.__mapper__.column_attrs}
+
+
+def _parse(cls: type, values: dict[str, Any]) -> dict[str, Any]:
+    parsed = {}
+    for attr in cls.__mapper__.column_attrs:  # type: ignore
+        value = values[attr.key]
+        python_type = attr.columns[0].type.python_type
+        if value is not None and not isinstance(value, python_type):
+            value = datetime.fromisoformat(value) if python_type is datetime else python_type(value)
+        parsed[attr.key] = value
+    return parsed
+
+
+def _instance(cls: Type[EntityT], values: dict[str, Any]) -> EntityT:
+    entity = cls.__mapper__.class_manager.new_instance()  # type: ignore
+    for key, value in values.items():
+        set_committed_value(entity, key, value)
+    make_transient_to_detached(entity)
+    return entity
+
+
+def _current(raw: bytes | None, version: bytes | None) -> dict[str, Any] | None:
+    entry = orjson.loads(raw) if raw is not None else None
+    return entry if entry is not None and entry.get("version") == int(version or 0) else None
+
+
+async def lookup(session: AsyncSession, cls: Type[EntityT], entity_id: UUID) -> tuple[EntityT | None, int | None]:
+    """The cached entity merged into `session` without a query, or the version to `store` it with after loading.
+
+    Relationships of a cached entity are left unloaded. The version is None when redis couldn't be read,
+    the entity is then loaded from the database and not cached.
+    """
+    # the session's own copy may hold changes the cache doesn't
+    existing = session.sync_session.identity_map.get(identity_key(cls, entity_id))
+    if existing is not None:
+        return existing, None  # type: ignore
+    table = cls.__tablename__  # type: ignore
+    values = _local.get((table, str(entity_id)))
+    if values is not None:
+        ENTITY_CACHE_LOOKUPS.inc(table=table, tier="local")
+        version = None
+    else:
+        try:
+            with REDIS_COMMAND_DURATION.time(op="entity_lookup"):
+                raw, raw_version = await get_redis().mget(
+                    ENTITY_KEY.format(table, entity_id), VERSION_KEY.format(table, entity_id)
+                )
+        except Exception as e:
+            logger.warning(f"unable to look up cached {table} {entity_id}, loading it from the database: {e!r}")
+            ENTITY_CACHE_LOOKUPS.inc(table=table, tier="miss")
+            return None, None
+        version = int(raw_version or 0)
+        entry = _current(raw, raw_version)
+        if entry is None:
+            ENTITY_CACHE_LOOKUPS.inc(table=table, tier="miss")
+            return None, version
+        ENTITY_CACHE_LOOKUPS.inc(table=table, tier="redis")
+        values = _parse(cls, entry["values"])
+        _local[(table, str(entity_id))] = values
+    return await session.merge(_instance(cls, values), load=False), version
+
+
+async def cached_ids(cls: type, entity_ids: Iterable[UUID]) -> set[UUID]:
+    """The ids with a cached entity, which existed when they were cached."""
+    table = cls.__tablename__  # type: ignore
+    found, remote = set(), []
+    for entity_id in entity_ids:
+        if (table, str(entity_id)) in _local:
+            found.add(entity_id)
+        else:
+            remote.append(entity_id)
+    if remote:
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for entity_id in remote:
+                    pipe.mget(ENTITY_KEY.format(table, entity_id), VERSION_KEY.format(table, entity_id))
+                with REDIS_COMMAND_DURATION.time(op="entity_cached_ids"):
+                    entries = await pipe.execute()
+        except Exception as e:
+            # the caller checks the ids not found here in the database
+            logger.warning(f"unable to look up cached {table} ids: {e!r}")
+            return found
+        found.update(entity_id for entity_id, entry in zip(remote, entries) if _current(*entry) is not None)
+    return found
+
+
+async def store(session: AsyncSession, entity: Any, version: int | None):
+    """Cache an entity just read, unless the session wrote anything it may not commit.
+
+    `version` is the one `lookup` returned before the entity was loaded, the entity isn't cached if
+    a write invalidated it since or the version is unknown.
+    """
+    if version is None or session.info.get("changed_tables"):
+        return
+    table = entity.__tablename__
+    values = _dump(entity)
+    try:
+        with REDIS_COMMAND_DURATION.time(op="entity_store"):
+            stored = await get_redis().eval(
+                _STORE_SCRIPT,
+                2,
+                ENTITY_KEY.format(table, entity.id),
+                VERSION_KEY.format(table, entity.id),
+                version,
+                orjson.dumps({"version": version, "values": values}),
+                int(settings.cache.entity_ttl_seconds * 1000),
+            )  # type: ignore
+    except Exception as e:
+        logger.warning(f"unable to cache {table} {entity.id}: {e!r}")
+        return
+    if stored:
+        _local[(table, str(entity.id))] = values
+
+
+def _changed(session: Session | AsyncSession) -> dict[str, set[str]]:
+    return session.info.setdefault("changed_entities", {})
+
+
+def changed(session: AsyncSession, cls: type, entity_ids: Iterable[UUID]):
+    """Invalidate the entities after the session commits, for writes that bypass the flush."""
+    if is_cached(cls):
+        _changed(session).setdefault(cls.__tablename__, set()).update(map(str, entity_ids))  # type: ignore
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session: Session, flush_context: UOWTransaction):
+    for entity in [*session.dirty, *session.deleted]:
+        if is_cached(type(entity)):
+            _changed(session).setdefault(entity.__tablename__, set()).add(str(entity.id))
+
+
+def _drop_local(changes: dict[str, list[str]]):
+    for table, ids in changes.items():
+        for entity_id in ids:
+            _local.pop((table, entity_id), None)
+
+
+async def _invalidate(changes: dict[str, list[str]]):
+    # versions outlive the entries, so an entry of an older version can't be served after a version expired
+    version_ttl = int(settings.cache.entity_ttl_seconds * 2000)
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for table, ids in changes.items():
+                for entity_id in ids:
+                    pipe.incr(VERSION_KEY.format(table, entity_id))
+                    pipe.pexpire(VERSION_KEY.format(table, entity_id), version_ttl)
+                pipe.delete(*[ENTITY_KEY.format(table, entity_id) for entity_id in ids])
+            pipe.publish(INVALIDATION_CHANNEL, orjson.dumps(changes))
+            with REDIS_COMMAND_DURATION.time(op="entity_invalidate"):
+                await pipe.execute()
+    except Exception:
+        logger.exception(f"unable to invalidate cached entities {changes}")
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    changes = {table: sorted(ids) for table, ids in session.info.pop("changed_entities", {}).items() if ids}
+    if not changes:
+        return
+    _drop_local(changes)
+    notify_after_commit(session, _invalidate(changes))
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session: Session):
+    session.info.pop("changed_entities", None)
+
+
+async def run_invalidation_listener():
+    """Drop the entities other processes changed, runs until cancelled."""
+    while True:
+        pubsub = get_redis().pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    _drop_local(orjson.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("entity cache invalidation listener failed, reconnecting")
+            # messages may have been missed while disconnected
+            _local.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
@@ -4,10 +4,10 @@ from typing import Type
 from fastapi.params import Depends as Depends_Type
 
 
-def find_fastapi_param_name(handler, param_type: Type):
+def find_fastapi_param_name(handler, *param_types: Type):
     for param in inspect.signature(handler).parameters.values():
         if (
-            param.annotation is param_type
+            param.annotation in param_types
             and type(param.default) is Depends_Type
             and (
                 param.kind == inspect.Parameter.POSITIONAL_ONLY or param.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD
@@ -17,5 +17,5 @@ def find_fastapi_param_name(handler, param_type: Type):
     else:
         raise Exception(
             f"Function {handler.__name__} should have a positional or keyword argument of "
-            f"type {param_type} with a dependency"
+            f"type {' or '.join(str(param_type) for param_type in param_types)} with a dependency"
         )
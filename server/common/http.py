@@ -1,9 +1,10 @@
 from datetime import datetime
+from enum import Enum
 from typing import Generic, List, TypeVar
 
 from fastapi import Request
 from fastapi.params import Query
-from fastapi_pagination.bases import AbstractPage, AbstractParams, RawParams
+from fastapi_pagination.bases import AbstractPage, AbstractParams, CursorRawParams, RawParams
 from pydantic import BaseModel, ConfigDict
 from starlette.datastructures import Headers
 
@@ -19,8 +20,21 @@ class DataResponse(BaseModel, Generic[DataT]):
     model_config = ConfigDict(json_encoders={datetime: lambda dt: dt.strftime(DEFAULT_DATETIME_FORMAT)})
 
 
+class TotalStrategy(str, Enum):
+    # COUNT(*) of the filtered query
+    exact = "exact"
+    # exact count kept in redis until it expires or one of the tables is written to
+    cached = "cached"
+    # planner row estimate, can be off by a lot on filtered queries
+    estimated = "estimated"
+    # no total, only has_next
+    none = "none"
+
+
 class PaginationData(BaseModel):
-    total: int
+    total: int | None
+    total_strategy: TotalStrategy = TotalStrategy.exact
+    has_next: bool
     page: int
     size: int
 
@@ -46,10 +60,55 @@ class PageDataResponse(AbstractPage[DataT], Generic[DataT]):
     def create(
         cls,
         items: List[DataT],
-        total: int,
+        total: int | None,
         params: Params,
+        *,
+        total_strategy: TotalStrategy = TotalStrategy.exact,
+        has_next: bool | None = None,
+        **kwargs,
     ) -> "PageDataResponse[DataT]":
-        return cls(data=items, pagination=PaginationData(total=total, page=params.page, size=params.size))
+        if has_next is None:
+            has_next = total is not None and params.page * params.size < total
+        return cls(
+            data=items,
+            pagination=PaginationData(
+                total=total, total_strategy=total_strategy, has_next=has_next, page=params.page, size=params.size
+            ),
+        )
+
+
+class CursorPaginationData(BaseModel):
+    size: int
+    # None on the last page
+    next_cursor: str | None
+
+
+class CursorParams(BaseModel, AbstractParams):
+    cursor: str | None = Query(None, description="Cursor of the page, the next_cursor of the previous page")  # type: ignore
+    size: int = Query(10, ge=1, le=100, description="Page size")  # type: ignore
+
+    def to_raw_params(self) -> CursorRawParams:
+        return CursorRawParams(cursor=self.cursor, size=self.size)
+
+
+class CursorPageDataResponse(AbstractPage[DataT], Generic[DataT]):
+    data: List[DataT]
+    pagination: CursorPaginationData
+
+    __params_type__ = CursorParams
+
+    model_config = ConfigDict(json_encoders={datetime: lambda dt: dt.strftime(DEFAULT_DATETIME_FORMAT)})
+
+    @classmethod
+    def create(
+        cls,
+        items: List[DataT],
+        params: CursorParams,
+        *,
+        next_cursor: str | None = None,
+        **kwargs,
+    ) -> "CursorPageDataResponse[DataT]":
+        return cls(data=items, pagination=CursorPaginationData(size=params.size, next_cursor=next_cursor))
 
 
 def set_request_header(request: Request, key: str, value: str):
@@ -1,4 +1,6 @@
 import logging
+import time
+from http.client import INTERNAL_SERVER_ERROR
 from os import environ
 from typing import Callable
 
@@ -6,22 +8,41 @@ from fastapi import Request, Response
 from fastapi.exceptions import HTTPException
 from fastapi.routing import APIRoute
 
+from server.common.metrics import Histogram
+from server.common.query_stats import check_query_budget, track_queries
+from server.config import settings
+
 LOCAL_LOGGING_FORMAT = "%(asctime)s %(levelname)s [%(name)s:%(lineno)d] %(message)s"
 
 logger = logging.getLogger(__name__)
 
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests per route template", ["method", "route", "status"]
+)
+
 
 class LoggingRoute(APIRoute):
     def get_route_handler(self) -> Callable:
         original_route_handler = super().get_route_handler()
+        budget = getattr(self.endpoint, "__query_budget__", None)
 
         async def custom_route_handler(request: Request) -> Response:
             path = str(request.url).replace(str(request.base_url), "/")
+            start = time.perf_counter()
+            status = INTERNAL_SERVER_ERROR
             try:
-                response = await original_route_handler(request)
-                logger.info(f"[{response.status_code} {request.method}] {path}")
+                with track_queries(f"{request.method} {self.path_format}") as queries:
+                    response = await original_route_handler(request)
+                status = response.status_code
+                db = f"[db: {queries.count} in {queries.duration * 1000:.1f}ms]"
+                logger.info(f"[{response.status_code} {request.method}] {db} {path}")
+                check_query_budget(queries, budget)
+                if settings.is_dev():
+                    response.headers["X-DB-Query-Count"] = str(queries.count)
+                    response.headers["X-DB-Query-Time-Ms"] = f"{queries.duration * 1000:.1f}"
                 return response
             except HTTPException as exc:
+                status = exc.status_code
                 try:
                     body = await request.body()
                     body = body.decode("utf-8")
@@ -30,6 +51,10 @@ class LoggingRoute(APIRoute):
                 except:
                     logger.exception("unable to log route")
                 raise exc
+            finally:
+                HTTP_REQUEST_DURATION.observe(
+                    time.perf_counter() - start, method=request.method, route=self.path_format, status=str(status)
+                )
 
         return custom_route_handler
 
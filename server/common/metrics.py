@@ -0,0 +1,227 @@
+"""In-process metrics with a Prometheus text exposition.
+
+Every process records into its own registry and periodically publishes a snapshot to redis,
+`/metrics` merges the snapshots of all live uvicorn and arq processes.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import time
+from bisect import bisect_left
+from typing import Callable, Iterator, Sequence
+
+import orjson
+
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_KEY = "metrics:snapshots"
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+LabelValues = tuple[str, ...]
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: "Registry | None" = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self) -> dict:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[LabelValues, float] = {}
+
+    def inc(self, value: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        return {"samples": [[list(key), value] for key, value in self.values.items()]}
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # per label values: count per bucket (the last one is +Inf), sum
+        self.values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": self.buckets,
+            "samples": [[list(key), counts, total[0]] for key, (counts, total) in self.values.items()],
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Register a function that updates gauges right before a snapshot is taken."""
+        self.collectors.append(func)
+        return func
+
+    def snapshot(self) -> dict:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception:
+                logger.exception(f"metrics collector {collect.__name__} failed")
+        return {
+            "updated_at": time.time(),
+            "metrics": {
+                name: {"type": metric.type, "help": metric.help, "labels": metric.label_names, **metric.snapshot()}
+                for name, metric in self.metrics.items()
+            },
+        }
+
+
+REGISTRY = Registry()
+
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Duration of redis commands and pipelines issued by the app", ["op"]
+)
+
+
+async def publish_metrics():
+    snapshot = orjson.dumps(REGISTRY.snapshot())
+    with REDIS_COMMAND_DURATION.time(op="metrics_publish"):
+        await get_redis().hset(SNAPSHOTS_KEY, PROCESS_ID, snapshot)
+
+
+async def run_metrics_publisher():
+    while True:
+        try:
+            await publish_metrics()
+        except Exception:
+            logger.exception("Unable to publish metrics")
+        await asyncio.sleep(settings.metrics.publish_interval_seconds)
+
+
+async def collect_metrics() -> str:
+    """Merge the snapshots of all processes into the Prometheus text format.
+
+    Counters and histograms of processes that stopped publishing are kept until their snapshot expires,
+    so totals don't go backwards when a process restarts. Gauges only come from live processes and get
+    a `process` label.
+    """
+    await publish_metrics()
+    redis = get_redis()
+    now = time.time()
+    live_since = now - 3 * settings.metrics.publish_interval_seconds
+    expired = []
+    merged: dict[str, dict] = {}
+    with REDIS_COMMAND_DURATION.time(op="metrics_collect"):
+        snapshots = await redis.hgetall(SNAPSHOTS_KEY)
+    for process_id, raw in snapshots.items():
+        snapshot = orjson.loads(raw)
+        if snapshot["updated_at"] < now - settings.metrics.snapshot_ttl_seconds:
+            expired.append(process_id)
+            continue
+        live = snapshot["updated_at"] >= live_since
+        for name, metric in snapshot["metrics"].items():
+            _merge(merged, name, metric, process_id.decode(), live)
+    if expired:
+        await redis.hdel(SNAPSHOTS_KEY, *expired)
+    return "".join(_render(name, metric) for name, metric in sorted(merged.items()))
+
+
+def _merge(merged: dict[str, dict], name: str, metric: dict, process_id: str, live: bool):
+    target = merged.setdefault(name, {**metric, "samples": {}})
+    samples = target["samples"]
+    if metric["type"] == "gauge":
+        target["labels"] = [*metric["labels"], "process"]
+        if live:
+            for labels, value in metric["samples"]:
+                samples[(*labels, process_id)] = value
+    elif metric["type"] == "counter":
+        for labels, value in metric["samples"]:
+            samples[tuple(labels)] = samples.get(tuple(labels), 0) + value
+    else:
+        for labels, counts, total in metric["samples"]:
+            current = samples.get(tuple(labels))
+            if current is None:
+                samples[tuple(labels)] = (list(counts), total)
+            else:
+                samples[tuple(labels)] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _render(name: str, metric: dict) -> str:
+    lines = [f"# HELP {name} {metric['help']}", f"# TYPE {name} {metric['type']}"]
+    for labels, value in metric["samples"].items():
+        if metric["type"] != "histogram":
+            lines.append(f"{name}{_labels(metric['labels'], labels)} {value}")
+            continue
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip([*metric["buckets"], "+Inf"], counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f"{name}_bucket{_labels(metric['labels'], labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(metric['labels'], labels)} {total}")
+        lines.append(f"{name}_count{_labels(metric['labels'], labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
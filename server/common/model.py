@@ -1,40 +1,209 @@
+import asyncio
+import dataclasses
+import functools
 import logging
-from datetime import datetime
-from typing import Dict, Generic, List, Tuple, Type, TypeVar
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    get_args,
+)
 from uuid import UUID, uuid4
 
-from sqlalchemy import ColumnElement, func
+from pydantic import BaseModel
+from sqlalchemy import ColumnElement, Executable, PrimaryKeyConstraint, bindparam, func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, MappedAsDataclass, mapped_column
-from sqlalchemy.sql import Select, and_, select
+from sqlalchemy.orm import (
+    Mapped,
+    MappedAsDataclass,
+    defaultload,
+    joinedload,
+    lazyload,
+    load_only,
+    mapped_column,
+    raiseload,
+    selectinload,
+)
+from sqlalchemy.orm.interfaces import ORMOption
+from sqlalchemy.sql import Delete, Select, Update, and_, delete, select, update
 
+from server.common import entity_cache
+from server.common.database import session_manager
 from server.common.exceptions import not_found
 
 EntityT = TypeVar("EntityT", bound="EntityMixin")
 TemporalT = TypeVar("TemporalT", bound="TemporalMixin")
 logger = logging.getLogger(__name__)
 
+StatementT = TypeVar("StatementT", bound=Executable)
+
+# statements without caller provided criteria are built once per class and executed with bound parameters,
+# reusing the same object keeps SQLAlchemy from rebuilding the construct and its compiled cache key every call
+_statements: Dict[Tuple[type, str], Executable] = {}
+
+
+# asyncpg can't bind more parameters than this in one statement
+MAX_STATEMENT_PARAMETERS = 32767
+
+
+def cached_statement(cls: type, name: str, build: Callable[[], StatementT]) -> StatementT:
+    statement = _statements.get((cls, name))
+    if statement is None:
+        statement = _statements[(cls, name)] = build()
+    return statement  # type: ignore
+
+
+class Loading(str, Enum):
+    """How a query loads the entity's relationships."""
+
+    # in the same statement with a LEFT OUTER JOIN, the fewest round trips for a single row
+    joined = "joined"
+    # by a second statement over the distinct keys of the rows, no repeated columns on larger results
+    selectin = "selectin"
+    # not loaded, accessing them raises
+    none = "none"
+
+
+_LOADERS = {Loading.joined: joinedload, Loading.selectin: selectinload, Loading.none: raiseload}
+
+
+def _nested_model(annotation: Any) -> Type[BaseModel] | None:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in get_args(annotation):
+        if (model := _nested_model(arg)) is not None:
+            return model
+    return None
+
+
+@functools.cache
+def projection_options(entity: type, response_model: Type[BaseModel]) -> Tuple[ORMOption, ...]:
+    """Loader options loading only the columns and relationships `response_model` reads from `entity`.
+
+    Nested response models project their relationship the same way, relationships the model
+    doesn't read aren't loaded at all. Fields that aren't mapped attributes are ignored.
+    """
+    return tuple(_projection(entity, response_model, None))
+
+
+def _projection(entity: type, response_model: Type[BaseModel], path: Any) -> list[ORMOption]:
+    mapper = entity.__mapper__  # type: ignore
+    columns, options = [], []
+    for name, field in response_model.model_fields.items():
+        if name in mapper.column_attrs:
+            columns.append(mapper.column_attrs[name].class_attribute)
+        elif name in mapper.relationships:
+            relationship = mapper.relationships[name]
+            # loading a many-to-one relationship by a separate query needs the foreign key
+            columns.extend(
+                mapper.get_property_by_column(column).class_attribute for column in relationship.local_columns
+            )
+            nested = _nested_model(field.annotation)
+            if nested is not None:
+                attribute = relationship.class_attribute
+                options.extend(
+                    _projection(
+                        relationship.mapper.class_,
+                        nested,
+                        defaultload(attribute) if path is None else path.defaultload(attribute),
+                    )
+                )
+    for name, relationship in mapper.relationships.items():
+        if name not in response_model.model_fields:
+            attribute = relationship.class_attribute
+            options.append(lazyload(attribute) if path is None else path.lazyload(attribute))
+    if columns:
+        options.insert(0, load_only(*columns) if path is None else path.load_only(*columns))
+    return options
+
 
 class EntityMixin(MappedAsDataclass, Generic[EntityT]):
+    # `get` and `exists_all` without criteria are answered from `entity_cache` when set,
+    # meant for rarely changing models whose relationships aren't read after `get`
+    __entity_cache__ = False
+
     id: Mapped[UUID] = mapped_column(primary_key=True, default_factory=uuid4, init=False)
 
     @classmethod
-    def get_query(cls: Type[EntityT], entity_id: UUID, filter: ColumnElement | None = None) -> Select[Tuple[EntityT]]:
-        qs = select(cls)
+    def get_query(
+        cls: Type[EntityT],
+        entity_id: UUID,
+        filter: ColumnElement | None = None,
+        projection: Type[BaseModel] | None = None,
+        loading: Loading | None = Loading.joined,
+    ) -> Select[Tuple[EntityT]]:
+        qs = cls.select_query(projection, loading)
         if filter is None:
             return qs.where(cls.id == entity_id)
         else:
             return qs.where(and_(cls.id == entity_id, filter))
 
+    @classmethod
+    def select_query(
+        cls: Type[EntityT], projection: Type[BaseModel] | None = None, loading: Loading | None = None
+    ) -> Select[Tuple[EntityT]]:
+        """SELECT of the entity, of only the attributes read by `projection` when it's given.
+
+        `loading` applies to the relationships `projection` reads, or all of them without one,
+        None keeps the strategy they are declared with.
+        """
+        qs = select(cls)
+        if projection is not None:
+            qs = qs.options(*projection_options(cls, projection))
+        if loading is not None:
+            names = cls.__mapper__.relationships.keys()  # type: ignore
+            if projection is not None:
+                names = [name for name in names if name in projection.model_fields]
+            qs = qs.options(*[_LOADERS[loading](getattr(cls, name)) for name in names])
+        return qs
+
+    @classmethod
+    def get_by_id_statement(
+        cls: Type[EntityT], projection: Type[BaseModel] | None = None, loading: Loading | None = Loading.joined
+    ) -> Select[Tuple[EntityT]]:
+        """Prebuilt `get_query` without a filter, execute it with an `entity_id` parameter."""
+        name = f"get:{loading and loading.value}"
+        if projection is not None:
+            name = f"{name}:{projection.__module__}.{projection.__qualname__}"
+        return cached_statement(
+            cls, name, lambda: cls.select_query(projection, loading).where(cls.id == bindparam("entity_id"))
+        )
+
     @classmethod
     async def get(
-        cls: Type[EntityT], db: AsyncSession, entity_id: UUID, filter: ColumnElement | None = None
+        cls: Type[EntityT],
+        db: AsyncSession,
+        entity_id: UUID,
+        filter: ColumnElement | None = None,
+        projection: Type[BaseModel] | None = None,
+        loading: Loading | None = Loading.joined,
     ) -> EntityT:
-        qs = cls.get_query(entity_id, filter)
-        res = await db.execute(qs)
+        cached = filter is None and projection is None and entity_cache.is_cached(cls)
+        if cached:
+            entity, version = await entity_cache.lookup(db, cls, entity_id)
+            if entity is not None:
+                return entity
+        if filter is None:
+            qs = cls.get_by_id_statement(projection, loading)
+            res = await db.execute(qs, {"entity_id": entity_id})
+        else:
+            res = await db.execute(cls.get_query(entity_id, filter, projection, loading))
         obj = res.unique().scalar_one_or_none()
         if obj is None:
             raise not_found(f"Entity {cls.__name__} with id {entity_id} not found")
+        if cached:
+            await entity_cache.store(db, obj, version)
         return obj
 
     @classmethod
@@ -56,6 +225,63 @@ class EntityMixin(MappedAsDataclass, Generic[EntityT]):
         db.add(self)
         await db.flush()
 
+    @classmethod
+    def _insert_batches(cls: Type[EntityT], rows: Sequence[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """Column values of the rows with the dataclass defaults applied, in batches under the parameter limit."""
+        init_fields = {field.name for field in dataclasses.fields(cls) if field.init}  # type: ignore
+        columns = [attr.key for attr in cls.__mapper__.column_attrs]  # type: ignore
+        batch_size = max(1, MAX_STATEMENT_PARAMETERS // len(columns))
+        for start in range(0, len(rows), batch_size):
+            batch = []
+            for row in rows[start : start + batch_size]:
+                entity = cls(**{key: value for key, value in row.items() if key in init_fields})
+                for key, value in row.items():
+                    if key not in init_fields:
+                        setattr(entity, key, value)
+                batch.append({column: getattr(entity, column) for column in columns})
+            yield batch
+
+    @classmethod
+    async def bulk_create(cls: Type[EntityT], db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> list[EntityT]:
+        """Insert the rows with one multi-row INSERT ... RETURNING per batch."""
+        entities: list[EntityT] = []
+        for batch in cls._insert_batches(rows):
+            res = await db.scalars(insert(cls).values(batch).returning(cls))
+            entities.extend(res.all())
+        return entities
+
+    @classmethod
+    async def upsert(
+        cls: Type[EntityT],
+        db: AsyncSession,
+        values: Sequence[Dict[str, Any]],
+        conflict_cols: Sequence[str],
+        update_cols: Sequence[str] = (),
+    ) -> list[EntityT]:
+        """Insert the rows or update `update_cols` of the rows already present by `conflict_cols`.
+
+        Unlike `find_or_create` it's a single statement per batch and concurrent callers don't race,
+        the returned entities hold the stored values of both inserted and updated rows.
+        """
+        if issubclass(cls, PartitionedMixin) and "created_at" not in conflict_cols:
+            # unique constraints of a partitioned table include the partition key, id alone isn't one
+            raise ValueError(f"conflict_cols of partitioned {cls.__name__} must include created_at")
+        entities: list[EntityT] = []
+        for batch in cls._insert_batches(values):
+            qs = insert(cls).values(batch)
+            update = {col: qs.excluded[col] for col in update_cols}
+            if update and "updated_at" in batch[0] and "updated_at" not in update:
+                update["updated_at"] = qs.excluded["updated_at"]
+            # updating a conflict column to itself keeps the row in RETURNING, DO NOTHING would skip it
+            qs = qs.on_conflict_do_update(
+                index_elements=conflict_cols, set_=update or {conflict_cols[0]: qs.excluded[conflict_cols[0]]}
+            )
+            res = await db.scalars(qs.returning(cls), execution_options={"populate_existing": True})
+            batch_entities = res.all()
+            entity_cache.changed(db, cls, [entity.id for entity in batch_entities])
+            entities.extend(batch_entities)
+        return entities
+
     @classmethod
     def list_query(
         cls: Type[EntityT],
@@ -63,8 +289,10 @@ class EntityMixin(MappedAsDataclass, Generic[EntityT]):
         limit: int | None = None,
         offset: int | None = None,
         order_by: ColumnElement | None = None,
+        projection: Type[BaseModel] | None = None,
+        loading: Loading | None = None,
     ) -> Select[Tuple[EntityT]]:
-        qs = select(cls)
+        qs = cls.select_query(projection, loading)
         qs = qs if filter is None else qs.where(filter)
         qs = qs if limit is None else qs.limit(limit)
         qs = qs if offset is None else qs.offset(offset)
@@ -79,38 +307,139 @@ class EntityMixin(MappedAsDataclass, Generic[EntityT]):
         limit: int | None = None,
         offset: int | None = None,
         order_by: ColumnElement | None = None,
+        projection: Type[BaseModel] | None = None,
+        loading: Loading | None = None,
     ) -> list[EntityT]:
-        qs = cls.list_query(filter, limit, offset, order_by)
+        qs = cls.list_query(filter, limit, offset, order_by, projection, loading)
         res = await db.execute(qs)
         raw = res.unique().all()
         return [r[0] for r in raw]
 
+    @classmethod
+    async def stream(
+        cls: Type[EntityT],
+        db: AsyncSession,
+        filter: ColumnElement | None = None,
+        order_by: ColumnElement | None = None,
+        batch_size: int = 1000,
+        projection: Type[BaseModel] | None = None,
+        loading: Loading | None = None,
+    ) -> AsyncIterator[EntityT]:
+        """Matching entities read over a server side cursor, `batch_size` rows are held at a time.
+
+        The cursor lives in the session's transaction, keep the session open until the iteration ends.
+        """
+        res = await db.stream_scalars(
+            cls.list_query(filter, order_by=order_by, projection=projection, loading=loading),
+            execution_options={"yield_per": batch_size},
+        )
+        async for entity in res:
+            yield entity
+
     @classmethod
     async def delete(cls: Type[EntityT], db: AsyncSession, entity_id: UUID) -> bool:
-        qs = select(cls).where(cls.id == entity_id)
-        res = await db.execute(qs)
-        entity = res.scalar_one_or_none()
-        if entity is None:
-            return False
-        else:
-            await db.delete(entity)
-            return True
+        return len(await cls.delete_where(db, cls.id == entity_id)) > 0
+
+    @classmethod
+    async def delete_where(cls: Type[EntityT], db: AsyncSession, filter: ColumnElement) -> List[UUID]:
+        """Delete the matching rows with a single statement, returns their ids."""
+        res = await db.execute(delete(cls).where(filter).returning(cls.id))
+        ids = list(res.scalars())
+        entity_cache.changed(db, cls, ids)
+        return ids
+
+    @classmethod
+    async def update_where(
+        cls: Type[EntityT], db: AsyncSession, filter: ColumnElement, values: Dict[str, Any]
+    ) -> List[UUID]:
+        """Update the matching rows with a single statement, returns their ids."""
+        res = await db.execute(update(cls).where(filter).values(**values).returning(cls.id))
+        ids = list(res.scalars())
+        entity_cache.changed(db, cls, ids)
+        return ids
+
+    @classmethod
+    async def delete_where_batched(
+        cls: Type[EntityT], filter: ColumnElement, batch_size: int = 1000, pause_seconds: float = 0
+    ) -> int:
+        """`delete_where` over large ranges, see `_walk_batches`. Returns the number of deleted rows."""
+        return await cls._walk_batches(
+            lambda ids: delete(cls).where(cls.id.in_(ids)), filter, batch_size, pause_seconds
+        )
+
+    @classmethod
+    async def update_where_batched(
+        cls: Type[EntityT],
+        filter: ColumnElement,
+        values: Dict[str, Any],
+        batch_size: int = 1000,
+        pause_seconds: float = 0,
+    ) -> int:
+        """`update_where` over large ranges, see `_walk_batches`. Returns the number of updated rows."""
+        return await cls._walk_batches(
+            lambda ids: update(cls).where(cls.id.in_(ids)).values(**values), filter, batch_size, pause_seconds
+        )
+
+    @classmethod
+    async def _walk_batches(
+        cls: Type[EntityT],
+        build: Callable[[Select], Delete | Update],
+        filter: ColumnElement,
+        batch_size: int,
+        pause_seconds: float,
+    ) -> int:
+        """Run the statement on `batch_size` matching rows at a time in ascending id order.
+
+        Every batch is its own short transaction, so a large cleanup doesn't hold its locks or
+        produce its WAL all at once, and continues after the last id of the previous batch.
+        """
+        total = 0
+        last_id: UUID | None = None
+        while True:
+            ids = select(cls.id).where(filter).order_by(cls.id).limit(batch_size)
+            if last_id is not None:
+                ids = ids.where(cls.id > last_id)
+            async with session_manager.session() as db:
+                res = await db.execute(build(ids).returning(cls.id), execution_options={"synchronize_session": False})
+                batch = list(res.scalars())
+                entity_cache.changed(db, cls, batch)
+            if not batch:
+                return total
+            total += len(batch)
+            last_id = max(batch)
+            if pause_seconds:
+                await asyncio.sleep(pause_seconds)
 
     @classmethod
     async def exists_all(cls: Type[EntityT], db: AsyncSession, entity_ids: List[UUID]) -> bool:
         ids = set(entity_ids)
-        query = select(func.count(cls.id)).where(cls.id.in_(ids))
-        res = await db.execute(query)
+        if entity_cache.is_cached(cls):
+            ids -= await entity_cache.cached_ids(cls, ids)
+            if not ids:
+                return True
+        query = cached_statement(
+            cls, "count_ids", lambda: select(func.count(cls.id)).where(cls.id.in_(bindparam("ids", expanding=True)))
+        )
+        res = await db.execute(query, {"ids": list(ids)})
         return res.scalar_one() == len(ids)
 
     @classmethod
-    async def exists(cls: Type[EntityT], db: AsyncSession, criteria: ColumnElement) -> bool:
-        query = select(func.count(cls.id)).where(criteria)
-        res = await db.execute(query)
+    async def exists(cls: Type[EntityT], db: AsyncSession, criteria: ColumnElement | UUID) -> bool:
+        """Whether a row matches `criteria`, an id is checked with a prebuilt statement."""
+        if isinstance(criteria, UUID):
+            query = cached_statement(
+                cls, "exists_id", lambda: select(func.count(cls.id)).where(cls.id == bindparam("entity_id"))
+            )
+            res = await db.execute(query, {"entity_id": criteria})
+        else:
+            res = await db.execute(select(func.count(cls.id)).where(criteria))
         return res.scalar_one() > 0
 
 
 class TemporalMixin(MappedAsDataclass, Generic[TemporalT]):
+    # fetch the server side updated_at with UPDATE ... RETURNING instead of expiring it
+    __mapper_args__ = {"eager_defaults": True}
+
     created_at: Mapped[datetime] = mapped_column(default_factory=datetime.utcnow, nullable=False, init=False)
     updated_at: Mapped[datetime] = mapped_column(
         default_factory=datetime.utcnow,
@@ -122,8 +451,32 @@ class TemporalMixin(MappedAsDataclass, Generic[TemporalT]):
     @classmethod
     async def find_by_created_at_day(cls: Type[TemporalT], db: AsyncSession, created_at: datetime) -> list[TemporalT]:
         start = created_at.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = created_at.replace(hour=23, minute=59, second=59, microsecond=999999)
-        query = select(cls).where(cls.created_at.between(start, end))
+        query = select(cls).where(cls.created_at >= start, cls.created_at < start + timedelta(days=1))
         res = await db.execute(query)
         raw = res.unique().all()
         return [r[0] for r in raw]
+
+
+def partitioned_table_args(*args: Any) -> Tuple[Any, ...]:
+    """`__table_args__` of a `PartitionedMixin` model with its other constraints and indexes."""
+    # id leads the primary key so lookups by id alone still use its index in every partition
+    return (*args, PrimaryKeyConstraint("id", "created_at"), {"postgresql_partition_by": "RANGE (created_at)"})
+
+
+class PartitionedMixin(TemporalMixin[TemporalT]):
+    """Table range partitioned by month of `created_at`, partitions are managed in `server.common.partitions`.
+
+    Postgres needs the partition key in the primary key, so it's (id, created_at), declare the table
+    with `partitioned_table_args`. Queries with a `created_at` range only scan the matching partitions,
+    a lookup by id alone checks each of them. As id alone isn't unique, `upsert` needs `created_at` among
+    its conflict columns and the entity cache, which identifies entities by id, can't be enabled.
+    """
+
+    def __init_subclass__(cls, **kwargs: Any):
+        if getattr(cls, "__entity_cache__", False):
+            raise TypeError(f"partitioned {cls.__name__} can't set __entity_cache__, its id alone isn't unique")
+        super().__init_subclass__(**kwargs)
+
+    created_at: Mapped[datetime] = mapped_column(
+        primary_key=True, default_factory=datetime.utcnow, nullable=False, init=False
+    )
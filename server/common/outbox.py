@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from pydantic import ValidationError
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.common.database import Base, session_manager
+from server.common.dead_letter import add_dead_letter
+from server.common.model import EntityMixin, TemporalMixin
+from server.common.queue import JOB_DATA, JobData, JobName, enqueue_many
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxMessage(TemporalMixin, EntityMixin, Base):
+    __tablename__ = "outbox"
+
+    job_name: Mapped[str] = mapped_column(nullable=False)
+    payload: Mapped[dict] = mapped_column(type_=JSONB, nullable=False)
+
+
+def add_to_outbox(db: AsyncSession, job_name: JobName, job_data: JobData) -> OutboxMessage:
+    """Schedule a job as part of the current transaction.
+
+    The message is flushed together with the rest of the session, so the job only becomes
+    visible to the relay once the transaction that produced it commits.
+    """
+    message = OutboxMessage(job_name=job_name, payload=job_data.model_dump(mode="json", exclude_none=True))
+    db.add(message)
+    return message
+
+
+async def relay_outbox(batch_size: int) -> int:
+    """Move one batch of committed outbox messages to the queue.
+
+    Rows are locked with `SKIP LOCKED`, so concurrent relays work on disjoint batches.
+    Delivery is at least once: if the delete fails to commit the batch is enqueued again.
+    Messages that fail validation or can't be enqueued on their own are moved to the dead-letter
+    store, so they don't hold back the rest. Messages of jobs this process doesn't know are left
+    for one that does.
+    """
+    async with session_manager.session() as db:
+        qs = (
+            select(OutboxMessage)
+            .where(OutboxMessage.job_name.in_(list(JobName)))
+            .order_by(OutboxMessage.created_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        messages = (await db.scalars(qs)).all()
+        if not messages:
+            return 0
+
+        jobs: dict[JobName, list[tuple[OutboxMessage, JobData]]] = defaultdict(list)
+        for message in messages:
+            job_name = JobName(message.job_name)
+            try:
+                jobs[job_name].append((message, JOB_DATA[job_name].model_validate(message.payload)))
+            except ValidationError as e:
+                await _dead_letter(message, e)
+        for job_name, pending in jobs.items():
+            try:
+                await enqueue_many(job_name, [job_data for _, job_data in pending])
+            except Exception:
+                logger.exception(f"Unable to relay {len(pending)} {job_name} messages, relaying them one by one")
+                for message, job_data in pending:
+                    try:
+                        await enqueue_many(job_name, [job_data])
+                    except Exception as e:
+                        await _dead_letter(message, e)
+
+        await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_([message.id for message in messages])))
+        return len(messages)
+
+
+async def _dead_letter(message: OutboxMessage, error: Exception):
+    logger.error(f"Moving outbox message {message.id} to the dead letters: {error!r}")
+    await add_dead_letter(JobName(message.job_name), message.payload, repr(error), tries=0)
+
+
+async def run_outbox_relay():
+    while True:
+        try:
+            relayed = await relay_outbox(settings.task.outbox_batch_size)
+        except Exception:
+            logger.exception("Unable to relay outbox messages")
+            relayed = 0
+        if relayed < settings.task.outbox_batch_size:
+            await asyncio.sleep(settings.task.outbox_poll_interval_seconds)
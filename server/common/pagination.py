@@ -0,0 +1,151 @@
+"""Offset pagination with a choice of how the total is counted, and keyset pagination."""
+
+import base64
+import binascii
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Sequence
+from uuid import UUID
+
+import orjson
+from sqlalchemy import Select, Table, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute, undefer
+from sqlalchemy.sql.util import find_tables
+
+from server.common.changes import table_generations
+from server.common.database import session_manager
+from server.common.exceptions import bad_request
+from server.common.http import CursorPageDataResponse, CursorParams, PageDataResponse, Params, TotalStrategy
+from server.common.metrics import REDIS_COMMAND_DURATION
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+RELTUPLES = text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)")
+
+
+async def paginate(
+    db: AsyncSession, query: Select, params: Params, total: TotalStrategy = TotalStrategy.exact
+) -> PageDataResponse:
+    """Offset page of `query`, the total is counted as `total` says.
+
+    One extra row is fetched for `has_next`; when there is no next page the total follows from the
+    offset and no count runs at all.
+    """
+    raw = params.to_raw_params()
+    rows = list((await db.execute(query.limit(raw.limit + 1).offset(raw.offset))).unique().scalars())
+    items = rows[: params.size]
+    has_next = len(rows) > params.size
+    count = None
+    if not has_next and (items or not raw.offset):
+        count, total = (raw.offset or 0) + len(items), TotalStrategy.exact
+    elif total == TotalStrategy.exact:
+        count = await _count(db, query)
+    elif total == TotalStrategy.cached:
+        count = await _cached_count(db, query)
+    elif total == TotalStrategy.estimated:
+        count = await _estimated_count(db, query)
+    return PageDataResponse.create(items, count, params, total_strategy=total, has_next=has_next)
+
+
+async def _count(db: AsyncSession, query: Select) -> int:
+    res = await db.execute(select(func.count()).select_from(query.order_by(None).subquery()))
+    return res.scalar_one()
+
+
+def _tables(query: Select) -> list[str]:
+    return sorted({table.name for table in find_tables(query, include_aliases=True) if isinstance(table, Table)})
+
+
+async def _cached_count(db: AsyncSession, query: Select) -> int:
+    tables = _tables(query)
+    compiled = query.order_by(None).compile(dialect=db.get_bind().dialect)
+    try:
+        fingerprint = f"{compiled}|{sorted(compiled.params.items())}|{tables}|{await table_generations(tables)}"
+        key = f"page-total:{hashlib.sha1(fingerprint.encode()).hexdigest()}"
+        with REDIS_COMMAND_DURATION.time(op="page_total_get"):
+            cached = await get_redis().get(key)
+    except Exception as e:
+        logger.warning(f"unable to read a cached page total, counting: {e!r}")
+        return await _count(db, query)
+    if cached is not None:
+        return int(cached)
+    count = await _count(db, query)
+    # a lagging replica may not have the writes the generations already count
+    if not session_manager.lagging(db):
+        try:
+            with REDIS_COMMAND_DURATION.time(op="page_total_set"):
+                await get_redis().set(key, count, px=int(settings.cache.page_total_ttl_seconds * 1000))
+        except Exception as e:
+            logger.warning(f"unable to cache a page total: {e!r}")
+    return count
+
+
+async def _estimated_count(db: AsyncSession, query: Select) -> int:
+    tables = _tables(query)
+    if query.whereclause is None and len(tables) == 1:
+        # never analyzed tables report -1
+        reltuples = (await db.execute(RELTUPLES, {"table": tables[0]})).scalar_one_or_none()
+        if reltuples is not None and reltuples >= 0:
+            return int(reltuples)
+    compiled = query.order_by(None).compile(dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True})
+    connection = await db.connection()
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup or [])
+    res = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", parameters)
+    plan = res.scalar_one()
+    if isinstance(plan, str):
+        plan = orjson.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode()
+
+
+def decode_cursor(cursor: str, keys: Sequence[InstrumentedAttribute]) -> list[Any]:
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(keys):
+            raise ValueError()
+        return [_parse(key, value) for key, value in zip(keys, values)]
+    except (binascii.Error, ValueError, TypeError):
+        raise bad_request("Invalid cursor") from None
+
+
+def _parse(key: InstrumentedAttribute, value: Any) -> Any:
+    python_type = key.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is UUID:
+        return UUID(value)
+    return python_type(value)
+
+
+async def paginate_keyset(
+    db: AsyncSession,
+    query: Select,
+    params: CursorParams,
+    keys: Sequence[InstrumentedAttribute],
+    descending: bool = False,
+) -> CursorPageDataResponse:
+    """Page of `query` ordered by `keys`, the last key has to be unique (usually the id).
+
+    The cursor holds the keys of the page's last row, so every page is a range scan of `size + 1`
+    rows on an index over `keys` regardless of how deep it is, and rows changing on earlier pages
+    don't shift the following ones.
+    """
+    if params.cursor is not None:
+        last = tuple_(*decode_cursor(params.cursor, keys))
+        query = query.where(tuple_(*keys) < last if descending else tuple_(*keys) > last)
+    query = query.order_by(*[key.desc() if descending else key.asc() for key in keys]).limit(params.size + 1)
+    # the cursor is built from the keys, a projection may have left them out
+    query = query.options(*[undefer(key) for key in keys])
+    items = list((await db.execute(query)).unique().scalars())
+    next_cursor = None
+    if len(items) > params.size:
+        items = items[: params.size]
+        next_cursor = encode_cursor([getattr(items[-1], key.key) for key in keys])
+    return CursorPageDataResponse.create(items, params, next_cursor=next_cursor)
@@ -0,0 +1,111 @@
+"""Monthly range partitions of the tables of `PartitionedMixin` models.
+
+Partitions are named `{table}_pYYYYMM` and cover one calendar month of `created_at`, the maintenance
+keeps `months_ahead` future partitions around and detaches or drops the ones past their retention.
+"""
+
+import logging
+import re
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from server.common.database import Base, session_manager
+from server.common.model import PartitionedMixin
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+# held by the transaction maintaining a table, so runs of several workers don't detach the same partition
+MAINTENANCE_LOCK = text("SELECT pg_advisory_xact_lock(hashtext(:key))")
+PARTITIONS = text(
+    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = CAST(:table AS regclass)"
+)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(start: date, end: date) -> list[date]:
+    """First days of the months from `start` to `end`, both included."""
+    months, month = [], month_start(start)
+    while month <= end:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def partition_month(table: str, name: str) -> date | None:
+    match = re.fullmatch(rf"{re.escape(table)}_p(\d{{4}})(\d{{2}})", name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def create_partition_sql(table: str, month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def detach_partition_sql(table: str, month: date) -> str:
+    return f"ALTER TABLE {table} DETACH PARTITION {partition_name(table, month)}"
+
+
+def drop_partition_sql(table: str, month: date) -> str:
+    return f"DROP TABLE IF EXISTS {partition_name(table, month)}"
+
+
+def partitioned_tables() -> list[str]:
+    return sorted(
+        mapper.local_table.name  # type: ignore
+        for mapper in Base.registry.mappers
+        if issubclass(mapper.class_, PartitionedMixin)
+    )
+
+
+async def _maintain_table(connection: AsyncConnection, table: str, today: date):
+    await connection.execute(MAINTENANCE_LOCK, {"key": f"maintain-partitions:{table}"})
+    existing = {
+        month
+        for (name,) in await connection.execute(PARTITIONS, {"table": table})
+        if (month := partition_month(table, name)) is not None
+    }
+    current = month_start(today)
+    for month in months_between(current, add_months(current, settings.partitions.months_ahead)):
+        if month not in existing:
+            logger.info(f"creating partition {partition_name(table, month)}")
+            await connection.exec_driver_sql(create_partition_sql(table, month))
+    retention = settings.partitions.retention_months.get(table)
+    if retention is None:
+        return
+    for month in sorted(existing):
+        if month >= add_months(current, -retention):
+            break
+        logger.info(f"expiring partition {partition_name(table, month)} of {table}")
+        await connection.exec_driver_sql(detach_partition_sql(table, month))
+        if settings.partitions.expired == "drop":
+            await connection.exec_driver_sql(drop_partition_sql(table, month))
+
+
+async def maintain_partitions(today: date | None = None):
+    """Create the missing partitions up to `months_ahead` and expire the ones past retention.
+
+    Every table is maintained in its own transaction holding an advisory lock on the table, a
+    concurrent run waits for it and then finds the partitions already created or expired.
+    """
+    today = today or datetime.utcnow().date()
+    for table in partitioned_tables():
+        async with session_manager.connect() as connection:
+            await _maintain_table(connection, table, today)
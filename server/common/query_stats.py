@@ -0,0 +1,122 @@
+"""Per request (or job) SQL statement counting hooked into the engine events."""
+
+import contextlib
+import logging
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS, CACHING_DISABLED, NO_CACHE_KEY
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from server.common.metrics import Counter
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+HandlerT = TypeVar("HandlerT", bound=Callable)
+
+_PARAMS = re.compile(r"(\$\d+|%\(\w+\)s|\?|__\[POSTCOMPILE_\w+\])(::\w+(\[\])?)?")
+_PARAM_LISTS = re.compile(r"\?(\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+_CACHE_RESULTS = {CACHE_HIT: "hit", CACHE_MISS: "miss", CACHING_DISABLED: "disabled", NO_CACHE_KEY: "no_key"}
+
+DB_COMPILED_CACHE = Counter(
+    "db_compiled_cache_total", "Statements by SQLAlchemy compiled cache lookup result", ["result"]
+)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class QueryStats:
+    source: str
+    count: int = 0
+    duration: float = 0.0
+    # normalized statement -> executions
+    fingerprints: dict[str, int] = field(default_factory=dict)
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        key = fingerprint(statement)
+        self.fingerprints[key] = self.fingerprints.get(key, 0) + 1
+
+    def repeated_selects(self, threshold: int) -> list[tuple[str, int]]:
+        return [
+            (key, count)
+            for key, count in self.fingerprints.items()
+            if count > threshold and key.lstrip("( ").upper().startswith("SELECT")
+        ]
+
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def fingerprint(statement: str) -> str:
+    """Statement shape with parameters (and IN lists of any length) replaced by `?`."""
+    statement = _PARAMS.sub("?", statement)
+    statement = _PARAM_LISTS.sub("?", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def current_query_stats() -> QueryStats | None:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def track_queries(source: str) -> Iterator[QueryStats]:
+    """Count the statements run by the current task until the block exits and log probable N+1 patterns."""
+    stats = QueryStats(source)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        for key, count in stats.repeated_selects(settings.datastores.query_repeat_threshold):
+            logger.warning(f"probable N+1 in {source}: {count} executions of {key[:300]}")
+
+
+def query_budget(max_queries: int) -> Callable[[HandlerT], HandlerT]:
+    """Declare how many statements a route may run, checked by `LoggingRoute`."""
+
+    def decorator(handler: HandlerT) -> HandlerT:
+        handler.__query_budget__ = max_queries  # type: ignore
+        return handler
+
+    return decorator
+
+
+def check_query_budget(stats: QueryStats, budget: int | None):
+    if budget is None or stats.count <= budget:
+        return
+    message = f"{stats.source} ran {stats.count} statements, its budget is {budget}"
+    if settings.datastores.query_budget_strict:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def instrument_engine(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        DB_COMPILED_CACHE.inc(result=_CACHE_RESULTS.get(context.cache_hit, "no_key"))
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, duration)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
@@ -1,21 +1,39 @@
+import hashlib
+import logging
+from dataclasses import dataclass
 from enum import StrEnum
-from typing import Union
-from uuid import UUID
+from typing import Optional, Sequence, Union
+from uuid import UUID, uuid4
 
-from arq import create_pool
+from arq import ArqRedis, create_pool
 from arq.connections import RedisSettings
-from arq.jobs import Job
+from arq.constants import default_queue_name, in_progress_key_prefix, job_key_prefix
+from arq.jobs import Job, serialize_job
+from arq.utils import timestamp_ms, to_ms
 from pydantic import BaseModel
 
+from server.common.metrics import REDIS_COMMAND_DURATION, Counter, Histogram
 from server.config import settings
 
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ArqRedis] = None
+_owns_pool = False
+
 
 class JobName(StrEnum):
     process_article_job = "process_article_job"
+    process_articles_batch_job = "process_articles_batch_job"
+
+
+class QueueName(StrEnum):
+    interactive = default_queue_name
+    backfill = f"{default_queue_name}:backfill"
 
 
 class ProcessJobData(BaseModel):
     article_id: UUID
+    profile_id: UUID | None = None
 
 
 class EmptyJobData(BaseModel):
@@ -24,8 +42,251 @@ class EmptyJobData(BaseModel):
 
 JobData = Union[EmptyJobData, ProcessJobData]
 
+JOB_DATA: dict[JobName, type[JobData]] = {
+    JobName.process_article_job: ProcessJobData,
+    JobName.process_articles_batch_job: ProcessJobData,
+}
+
+# payloads of these jobs are collected in a pending set and drained by a single job run
+BATCH_JOBS = {JobName.process_articles_batch_job}
+
+# pops up to ARGV[3] ready items and leases them until ARGV[2]
+_DRAIN_BATCH_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, item in ipairs(items) do
+    redis.call('ZADD', KEYS[1], ARGV[2], item)
+end
+return items
+"""
+
+# removes (score -1) or reschedules leased items, unless they were enqueued again in the meantime
+_SETTLE_BATCH_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    if tonumber(redis.call('ZSCORE', KEYS[1], ARGV[i])) == tonumber(ARGV[1]) then
+        if ARGV[i + 1] == '-1' then
+            redis.call('ZREM', KEYS[1], ARGV[i])
+            redis.call('HDEL', KEYS[2], ARGV[i])
+        else
+            redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+        end
+    end
+end
+"""
+
+
+QUEUE_ENQUEUE_DURATION = Histogram("queue_enqueue_duration_seconds", "Duration of enqueue calls", ["job"])
+QUEUE_JOBS_ENQUEUED = Counter("queue_jobs_enqueued_total", "Jobs (or batch payloads) added to the queue", ["job"])
+QUEUE_JOBS_COALESCED = Counter("queue_jobs_coalesced_total", "Enqueues merged into an already queued job", ["job"])
+
+
+@dataclass
+class BatchItem:
+    member: str
+    data: JobData
+    job_try: int
+
+
+@dataclass
+class Batch:
+    job_name: JobName
+    lease_score: int
+    items: list[BatchItem]
+
+
+async def init_queue(pool: ArqRedis | None = None) -> ArqRedis:
+    """Set up the process-wide queue client, on the worker's own arq pool if one is passed."""
+    global _pool, _owns_pool
+    if _pool is None:
+        _owns_pool = pool is None
+        _pool = pool or await create_pool(RedisSettings.from_dsn(settings.datastores.redis_url))
+    return _pool
+
+
+async def get_queue() -> ArqRedis:
+    return _pool or await init_queue()
+
+
+async def close_queue():
+    global _pool, _owns_pool
+    if _pool and _owns_pool:
+        await _pool.close(close_connection_pool=True)
+    _pool = None
+    _owns_pool = False
+
+
+def queue_for(job_name: JobName) -> QueueName:
+    return QueueName[settings.task.job_lanes.get(job_name, QueueName.interactive.name)]
+
+
+def coalesce_job_id(job_name: JobName, job_data: JobData) -> str:
+    digest = hashlib.sha1(job_data.model_dump_json().encode()).hexdigest()
+    return f"{job_name}:{digest}"
+
+
+async def enqueue(
+    job_name: JobName, job_data: JobData, *, defer_by: float | None = None, queue_name: str | None = None
+) -> Job | None:
+    jobs = await enqueue_many(job_name, [job_data], defer_by=defer_by, queue_name=queue_name)
+    return jobs[0] if jobs else None
+
+
+async def enqueue_many(
+    job_name: JobName, jobs: Sequence[JobData], *, defer_by: float | None = None, queue_name: str | None = None
+) -> list[Job]:
+    """Enqueue a job per payload in one redis round trip, coalescing debounced and batching `BATCH_JOBS` payloads."""
+    queue_name = queue_name or queue_for(job_name)
+    if not jobs:
+        return []
+    with QUEUE_ENQUEUE_DURATION.time(job=job_name):
+        pool = await get_queue()
+        debounce = settings.task.debounce_seconds.get(job_name)
+        if job_name in BATCH_JOBS:
+            job_ids = await _add_batch_items(pool, job_name, jobs, queue_name)
+            QUEUE_JOBS_ENQUEUED.inc(len(jobs), job=job_name)
+        elif debounce is None:
+            job_ids = [uuid4().hex for _ in jobs]
+            await _write_jobs(pool, job_name, queue_name, dict(zip(job_ids, jobs)), coalesce=False, defer_by=defer_by)
+            QUEUE_JOBS_ENQUEUED.inc(len(job_ids), job=job_name)
+        else:
+            pending = {coalesce_job_id(job_name, job_data): job_data for job_data in jobs}
+            job_ids = await _enqueue_coalesced(
+                pool, job_name, queue_name, pending, debounce if defer_by is None else defer_by
+            )
+            QUEUE_JOBS_ENQUEUED.inc(len(job_ids), job=job_name)
+            QUEUE_JOBS_COALESCED.inc(len(jobs) - len(job_ids), job=job_name)
+            if len(job_ids) < len(jobs):
+                logger.debug(f"coalesced {len(jobs) - len(job_ids)} of {len(jobs)} {job_name} jobs")
+    return [Job(job_id, redis=pool, _queue_name=queue_name, _deserializer=pool.job_deserializer) for job_id in job_ids]
+
+
+async def _write_jobs(
+    pool: ArqRedis,
+    job_name: JobName,
+    queue_name: str,
+    jobs: dict[str, JobData],
+    *,
+    coalesce: bool,
+    defer_by: float | None = None,
+) -> list[str]:
+    if not jobs:
+        return []
+    enqueue_time_ms = timestamp_ms()
+    score = enqueue_time_ms + (to_ms(defer_by) or 0)
+    expires_ms = score - enqueue_time_ms + pool.expires_extra_ms
+    async with pool.pipeline(transaction=False) as pipe:
+        for job_id, job_data in jobs.items():
+            job = serialize_job(
+                job_name,
+                (),
+                job_data.model_dump(exclude_none=True),
+                None,
+                enqueue_time_ms,
+                serializer=pool.job_serializer,
+            )
+            # an existing job key means the same payload is already queued or running, leave it as is
+            pipe.set(job_key_prefix + job_id, job, px=expires_ms, nx=coalesce)
+            pipe.zadd(queue_name, {job_id: score}, nx=coalesce)
+        with REDIS_COMMAND_DURATION.time(op="enqueue"):
+            res = await pipe.execute()
+    created = res[::2]
+    return [job_id for job_id, ok in zip(jobs, created) if ok]
+
+
+async def _running_jobs(pool: ArqRedis, jobs: dict[str, JobData]) -> dict[str, JobData]:
+    if not jobs:
+        return {}
+    async with pool.pipeline(transaction=False) as pipe:
+        for job_id in jobs:
+            pipe.exists(in_progress_key_prefix + job_id)
+        with REDIS_COMMAND_DURATION.time(op="running_jobs"):
+            res = await pipe.execute()
+    return {job_id: job_data for (job_id, job_data), running in zip(jobs.items(), res) if running}
+
+
+async def _enqueue_coalesced(
+    pool: ArqRedis, job_name: JobName, queue_name: str, jobs: dict[str, JobData], defer_by: float
+) -> list[str]:
+    job_ids = await _write_jobs(pool, job_name, queue_name, jobs, coalesce=True, defer_by=defer_by)
+    running = await _running_jobs(
+        pool, {job_id: job_data for job_id, job_data in jobs.items() if job_id not in job_ids}
+    )
+    # a payload whose job is already running gets one follow-up job, so its latest state is processed
+    follow_ups = {f"{job_id}:next": job_data for job_id, job_data in running.items()}
+    return job_ids + await _write_jobs(pool, job_name, queue_name, follow_ups, coalesce=True, defer_by=defer_by)
+
+
+def _batch_key(job_name: JobName) -> str:
+    return f"arq:batch:{job_name}"
+
+
+def _batch_tries_key(job_name: JobName) -> str:
+    return f"arq:batch-tries:{job_name}"
+
+
+async def _add_batch_items(pool: ArqRedis, job_name: JobName, jobs: Sequence[JobData], queue_name: str) -> list[str]:
+    # LT keeps the earliest schedule of a pending payload, and pulls a leased one back so it runs again
+    now_ms = timestamp_ms()
+    with REDIS_COMMAND_DURATION.time(op="batch_add"):
+        await pool.zadd(_batch_key(job_name), {job_data.model_dump_json(): now_ms for job_data in jobs}, lt=True)
+    return await _schedule_batch_drain(pool, job_name, settings.task.batch_window_seconds, queue_name)
+
+
+async def _schedule_batch_drain(
+    pool: ArqRedis, job_name: JobName, defer_by: float, queue_name: str | None = None
+) -> list[str]:
+    drain = {f"{job_name}:drain": EmptyJobData()}
+    return await _enqueue_coalesced(pool, job_name, queue_name or queue_for(job_name), drain, defer_by)
+
+
+async def drain_batch(job_name: JobName, size: int) -> Batch:
+    """Lease up to `size` ready payloads of a batch job.
+
+    Leased payloads stay in the pending set with a score in the future, so they come back if the worker
+    dies before `settle_batch` acknowledges them.
+    """
+    pool = await get_queue()
+    now_ms = timestamp_ms()
+    lease_score = now_ms + to_ms(settings.task.batch_lease_seconds)
+    try:
+        with REDIS_COMMAND_DURATION.time(op="batch_drain"):
+            members = await pool.eval(_DRAIN_BATCH_SCRIPT, 1, _batch_key(job_name), now_ms, lease_score, size)  # type: ignore
+            members = [member.decode() for member in members]
+            tries = await pool.hmget(_batch_tries_key(job_name), members) if members else []
+    except Exception:
+        # payloads may have been leased already, drain again once they come back
+        await _schedule_batch_drain(pool, job_name, settings.task.batch_lease_seconds)
+        raise
+    items = [
+        BatchItem(member=member, data=JOB_DATA[job_name].model_validate_json(member), job_try=int(job_try or 0) + 1)
+        for member, job_try in zip(members, tries)
+    ]
+    return Batch(job_name=job_name, lease_score=lease_score, items=items)
+
 
-async def enqueue(job_name: JobName, job_data: JobData) -> Job | None:
-    pool = await create_pool(RedisSettings.from_dsn(settings.datastores.redis_url))
-    res = await pool.enqueue_job(job_name, **job_data.model_dump(exclude_none=True))
-    return res
+async def settle_batch(batch: Batch, done: Sequence[BatchItem], retries: Sequence[tuple[BatchItem, int]]):
+    """Acknowledge finished payloads, reschedule retried ones (`defer_ms` from now) and schedule the next drain."""
+    pool = await get_queue()
+    now_ms = timestamp_ms()
+    args: list = [batch.lease_score]
+    for item in done:
+        args += [item.member, -1]
+    for item, defer_ms in retries:
+        args += [item.member, now_ms + defer_ms]
+    next_drain: float | None = settings.task.batch_lease_seconds
+    try:
+        async with pool.pipeline(transaction=False) as pipe:
+            if retries:
+                pipe.hset(_batch_tries_key(batch.job_name), mapping={item.member: item.job_try for item, _ in retries})
+            if len(args) > 1:
+                pipe.eval(_SETTLE_BATCH_SCRIPT, 2, _batch_key(batch.job_name), _batch_tries_key(batch.job_name), *args)
+            pipe.zrange(_batch_key(batch.job_name), 0, 0, withscores=True)
+            with REDIS_COMMAND_DURATION.time(op="batch_settle"):
+                res = await pipe.execute()
+        next_drain = None
+        if res[-1]:
+            _, next_score = res[-1][0]
+            next_drain = 0 if len(batch.items) >= settings.task.batch_size else max(0, next_score - now_ms) / 1000
+    finally:
+        # if settling failed the leased payloads come back when their lease ends
+        if next_drain is not None:
+            await _schedule_batch_drain(pool, batch.job_name, next_drain)
@@ -0,0 +1,81 @@
+"""Response bodies of read endpoints cached in redis until they expire or one of their tables is written to."""
+
+import functools
+import hashlib
+import logging
+from typing import Any, Callable, Sequence, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from server.common.changes import table_generations
+from server.common.database import session_manager
+from server.common.metrics import REDIS_COMMAND_DURATION, Counter
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_REQUESTS = Counter("response_cache_requests_total", "Cacheable requests by result", ["route", "result"])
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def cached_response(response_model: Type[BaseModel], models: Sequence[type], ttl_seconds: float | None = None):
+    """Cache the route's serialized `response_model` by its parsed parameters.
+
+    Goes above `@transactional`. The key holds the generations of the `models`' tables, which
+    every commit writing to one of them bumps, so entries are stale from the next write on and
+    expire after `ttl_seconds` at the latest. A hit returns the stored body without touching the
+    database or validating it again. Responses read from a lagging replica aren't cached, they may
+    miss writes the generations already count. While redis fails the route runs uncached.
+    """
+    tables = sorted(model.__tablename__ for model in models)  # type: ignore
+    ttl = ttl_seconds if ttl_seconds is not None else settings.cache.response_ttl_seconds
+
+    def decorator(handler: Callable) -> Callable:
+        route = f"{handler.__module__}.{handler.__qualname__}"
+
+        @functools.wraps(handler)
+        async def wrapped(*args: Any, **kwargs: Any) -> Response:
+            params = {name: _normalize(value) for name, value in kwargs.items() if not isinstance(value, AsyncSession)}
+            key = None
+            try:
+                fingerprint = orjson.dumps([params, await table_generations(tables)], option=orjson.OPT_SORT_KEYS)
+                key = f"response-cache:{route}:{hashlib.sha1(fingerprint).hexdigest()}"
+                with REDIS_COMMAND_DURATION.time(op="response_cache_get"):
+                    body = await get_redis().get(key)
+            except Exception as e:
+                logger.warning(f"unable to read the response cache of {route}, running it uncached: {e!r}")
+                RESPONSE_CACHE_REQUESTS.inc(route=route, result="error")
+                key, body = None, None
+            if body is not None:
+                RESPONSE_CACHE_REQUESTS.inc(route=route, result="hit")
+                return Response(body, media_type="application/json")
+            if key is not None:
+                RESPONSE_CACHE_REQUESTS.inc(route=route, result="miss")
+            data = await handler(*args, **kwargs)
+            if isinstance(data, Response):
+                return data
+            content = data.model_dump() if isinstance(data, BaseModel) else data
+            body = orjson.dumps(response_model.model_validate(content).model_dump(mode="json"))
+            lagging = any(
+                isinstance(value, AsyncSession) and session_manager.lagging(value) for value in kwargs.values()
+            )
+            if key is not None and not lagging:
+                try:
+                    with REDIS_COMMAND_DURATION.time(op="response_cache_set"):
+                        await get_redis().set(key, body, px=int(ttl * 1000))
+                except Exception as e:
+                    logger.warning(f"unable to cache the response of {route}: {e!r}")
+            return Response(body, media_type="application/json")
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,110 @@
+"""Slow statement log with sampled EXPLAIN plans kept in redis."""
+
+import asyncio
+import contextvars
+import hashlib
+import logging
+import random
+import re
+import time
+from typing import Any
+
+import orjson
+from pydantic import BaseModel
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from server.common.metrics import REDIS_COMMAND_DURATION, Counter
+from server.common.query_stats import current_query_stats, fingerprint
+from server.common.redis import get_redis
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+PLANS_KEY = "slow-queries:plans"
+
+DB_SLOW_QUERIES = Counter("db_slow_queries_total", "Statements over the slow query threshold", ["source"])
+
+# keeps the explain tasks referenced until they finish
+_explains: set[asyncio.Task] = set()
+# statements that would lock rows or write when run again
+_NOT_PLAIN_SELECT = re.compile(
+    r"\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE|KEY\s+SHARE)\b|\bSKIP\s+LOCKED\b|\bNOWAIT\b|\bINTO\b", re.I
+)
+_explaining: contextvars.ContextVar[bool] = contextvars.ContextVar("explaining", default=False)
+
+
+class SlowQueryPlan(BaseModel):
+    fingerprint: str
+    source: str
+    duration: float
+    captured_at: float
+    plan: Any
+
+
+def redact(parameters: Any) -> Any:
+    """Parameter types only, values may hold personal data."""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return None if parameters is None else type(parameters).__name__
+
+
+def is_plain_select(statement: str) -> bool:
+    return statement.lstrip("( ").upper().startswith("SELECT") and not _NOT_PLAIN_SELECT.search(statement)
+
+
+async def _explain(engine: AsyncEngine, statement: str, parameters: Any, plan: SlowQueryPlan):
+    _explaining.set(True)
+    # ANALYZE runs the statement again, so only plain SELECTs get it and the transaction is rolled back anyway
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if is_plain_select(statement) else "FORMAT JSON"
+    try:
+        async with engine.connect() as connection:
+            result = await connection.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters)
+            plan.plan = result.scalar_one()
+            await connection.rollback()
+        key = hashlib.sha1(plan.fingerprint.encode()).hexdigest()
+        with REDIS_COMMAND_DURATION.time(op="slow_query_plan"):
+            await get_redis().hset(PLANS_KEY, key, plan.model_dump_json())
+    except Exception:
+        logger.exception(f"unable to explain slow query {plan.fingerprint[:300]}")
+
+
+async def list_plans() -> list[SlowQueryPlan]:
+    raw = await get_redis().hgetall(PLANS_KEY)
+    return sorted(
+        (SlowQueryPlan.model_validate(orjson.loads(value)) for value in raw.values()),
+        key=lambda plan: plan.duration,
+        reverse=True,
+    )
+
+
+def record_slow_queries(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["slow_query_start"].pop()
+        if duration < settings.datastores.slow_query_threshold_seconds or _explaining.get():
+            return
+        stats = current_query_stats()
+        source = stats.source if stats is not None else "unknown"
+        key = fingerprint(statement)
+        DB_SLOW_QUERIES.inc(source=source)
+        logger.warning(f"slow query {duration:.3f}s in {source}: {key} {redact(parameters)}")
+        if not executemany and random.random() < settings.datastores.slow_query_explain_sample_rate:
+            plan = SlowQueryPlan(fingerprint=key, source=source, duration=duration, captured_at=time.time(), plan=None)
+            # a fresh context so the EXPLAIN isn't counted against the request that triggered it
+            task = asyncio.get_running_loop().create_task(
+                _explain(engine, statement, parameters, plan), context=contextvars.Context()
+            )
+            _explains.add(task)
+            task.add_done_callback(_explains.discard)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("slow_query_start"):
+            context.connection.info["slow_query_start"].pop()
@@ -1,14 +1,31 @@
+import random
+import traceback
+
 from arq import Retry
 
+from server.common.dead_letter import add_dead_letter
+from server.common.metrics import Counter
+from server.common.queue import JobName
 from server.config import settings
 
+JOB_RETRIES = Counter("job_retries_total", "Failed jobs scheduled for another try", ["job"])
+
+
+def retry_delay(attempts_count: int, defer_base_seconds: float) -> float:
+    """Exponential backoff with full jitter, so failed jobs don't all retry at the same moment."""
+    backoff = min(settings.task.retry_max_delay_seconds, defer_base_seconds * 2 ** max(attempts_count - 1, 0))
+    return random.uniform(0, backoff)
+
 
-def handle_task_failure(logger, ctx, defer_base_seconds):
+async def handle_task_failure(logger, ctx, defer_base_seconds, job_name: JobName, payload: dict):
     attempts_count = ctx.get("job_try", settings.task.job_max_tries)
     if attempts_count is not None and attempts_count >= settings.task.job_max_tries:
         logger.exception("Task failed to finish and there will be no more retries!")
+        await add_dead_letter(job_name, payload, traceback.format_exc(), attempts_count)
     elif not settings.is_local():
         logger.exception("Task failed to finish and will be retried")
-        raise Retry(defer=attempts_count * defer_base_seconds)
+        JOB_RETRIES.inc(job=job_name)
+        raise Retry(defer=retry_delay(attempts_count, defer_base_seconds))
     else:
         logger.exception("Task failed to finish and will NOT be retried")
+        await add_dead_letter(job_name, payload, traceback.format_exc(), attempts_count)
@@ -1,18 +1,26 @@
+import asyncio
+import contextlib
 import logging.config
+from contextlib import asynccontextmanager
 from json import JSONEncoder
 
 import coloredlogs
 import uvicorn
 from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi_pagination import set_page
 
+from server.admin.routes import router as admin_router
 from server.articles.routes import router as articles_router
 from server.common.database import session_manager
+from server.common.entity_cache import run_invalidation_listener
 from server.common.http import PageDataResponse
 from server.common.json import TypeAwareEncoder
 from server.common.logging import LOCAL_LOGGING_FORMAT, LOGGING_CONFIG, LoggingRoute
+from server.common.metrics import collect_metrics, run_metrics_publisher
+from server.common.queue import close_queue, init_queue
+from server.common.redis import close_redis
 from server.config import settings
 from server.profiles.routes import router as profiles_router
 
@@ -23,10 +31,32 @@ if settings.is_local():
 JSONEncoder._old_default = JSONEncoder.default  # type: ignore
 JSONEncoder.default = TypeAwareEncoder.default  # type: ignore
 
-app = FastAPI(default_response_class=ORJSONResponse)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await init_queue()
+    tasks = [
+        asyncio.create_task(run_metrics_publisher()),
+        asyncio.create_task(session_manager.monitor_replicas()),
+        asyncio.create_task(run_invalidation_listener()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    await close_queue()
+    await close_redis()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 root = APIRouter(prefix="/api/v1", route_class=LoggingRoute)
-session_manager.init(settings.datastores.sqlalchemy_database_url)
+session_manager.init(
+    settings.datastores.sqlalchemy_database_url,
+    datastores=settings.datastores,
+    replica_urls=settings.datastores.sqlalchemy_replica_urls,
+)
 
 
 @root.get("/healthcheck")
@@ -34,8 +64,14 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(await collect_metrics(), media_type="text/plain; version=0.0.4")
+
+
 root.include_router(articles_router, prefix="/articles", tags=["articles"])
 root.include_router(profiles_router, prefix="/profiles", tags=["profiles"])
+root.include_router(admin_router, prefix="/admin", tags=["admin"])
 app.include_router(root)
 app.add_middleware(
     CORSMiddleware,
@@ -3,11 +3,11 @@ from typing import Any, Generic, Type, TypeVar
 from uuid import UUID
 
 from pydantic import BaseModel
-from sqlalchemy import ColumnElement, ForeignKey, Select, and_
+from sqlalchemy import ColumnElement, ForeignKey, Index, Select, and_, bindparam
 from sqlalchemy.orm import Mapped, declared_attr, mapped_column, relationship
 
 from server.common.database import DB, Base
-from server.common.model import EntityMixin, TemporalMixin
+from server.common.model import EntityMixin, Loading, TemporalMixin, cached_statement
 
 
 class ProfileRole(str, Enum):
@@ -17,6 +17,9 @@ class ProfileRole(str, Enum):
 
 class Profile(TemporalMixin, EntityMixin, Base):
     __tablename__ = "profiles"
+    # keyset pagination order
+    __table_args__ = (Index("ix_profiles_name_id", "name", "id"),)
+    __entity_cache__ = True
 
     name: Mapped[str] = mapped_column(nullable=False)
     role: Mapped[ProfileRole] = mapped_column(nullable=False, default=ProfileRole.USER)
@@ -30,6 +33,7 @@ class ProfileRelatedEntity(EntityMixin, Generic[ProfileRelatedT]):
 
     @declared_attr
     def profile(cls) -> Mapped["Profile"]:
+        # queries pick another strategy with `loading`, joined measured fastest for gets and pages (bench-loading)
         return relationship("Profile", lazy="joined", init=False)
 
     @classmethod
@@ -40,19 +44,27 @@ class ProfileRelatedEntity(EntityMixin, Generic[ProfileRelatedT]):
         limit: int | None = None,
         offset: int | None = None,
         order_by: ColumnElement | None = None,
+        loading: Loading | None = None,
     ) -> Select:
         if filter is None:
             profile_filter = cls.profile_id == profile_id
         else:
             profile_filter = and_(cls.profile_id == profile_id, filter)
-        return cls.list_query(profile_filter, limit, offset, order_by)
+        return cls.list_query(profile_filter, limit, offset, order_by, loading=loading)
 
     @classmethod
     async def list_for_profile(
-        cls: Type[ProfileRelatedT], db: DB, profile_id: UUID, filter: Any = None
+        cls: Type[ProfileRelatedT], db: DB, profile_id: UUID, filter: Any = None, loading: Loading | None = None
     ) -> list[ProfileRelatedT]:
-        qs = cls.list_query_for_profile(profile_id, filter)
-        res = await db.execute(qs)
+        if filter is None:
+            qs = cached_statement(
+                cls,
+                f"list_for_profile:{loading and loading.value}",
+                lambda: cls.list_query_for_profile(bindparam("profile_id"), loading=loading),  # type: ignore
+            )
+            res = await db.execute(qs, {"profile_id": profile_id})
+        else:
+            res = await db.execute(cls.list_query_for_profile(profile_id, filter, loading=loading))
         raw = res.unique().all()
         return [r[0] for r in raw]
 
@@ -1,26 +1,50 @@
 from fastapi import APIRouter, Depends
 from fastapi_pagination.bases import AbstractPage
-from fastapi_pagination.ext.sqlalchemy import paginate
 
-from server.common.database import DB, transactional
-from server.common.http import DataResponse, PageDataResponse, Params
+from server.common.database import DB, ReadDB, transactional
+from server.common.http import (
+    CursorPageDataResponse,
+    CursorParams,
+    DataResponse,
+    PageDataResponse,
+    Params,
+    TotalStrategy,
+)
 from server.common.logging import LoggingRoute
+from server.common.pagination import paginate, paginate_keyset
+from server.common.query_stats import query_budget
+from server.common.response_cache import cached_response
 from server.profiles.model import Profile, ProfileCreateData, ProfileResponseData
 
 router = APIRouter(route_class=LoggingRoute)
 
 
 @router.get("", response_model=PageDataResponse[ProfileResponseData])
+@cached_response(PageDataResponse[ProfileResponseData], [Profile])
+@query_budget(2)
 @transactional
-async def list_profiles(params: Params = Depends(), db: DB = Depends()) -> AbstractPage[Profile]:
+async def list_profiles(params: Params = Depends(), db: ReadDB = Depends()) -> AbstractPage[Profile]:
     return await paginate(
         db,
-        Profile.list_query(order_by=Profile.name.asc()),
+        Profile.list_query(order_by=Profile.name.asc(), projection=ProfileResponseData),
         params,
+        total=TotalStrategy.exact,
+    )
+
+
+@router.get("/cursor", response_model=CursorPageDataResponse[ProfileResponseData])
+@query_budget(1)
+@transactional
+async def list_profiles_by_cursor(
+    params: CursorParams = Depends(), db: ReadDB = Depends()
+) -> CursorPageDataResponse[Profile]:
+    return await paginate_keyset(
+        db, Profile.list_query(projection=ProfileResponseData), params, [Profile.name, Profile.id]
     )
 
 
 @router.post("", response_model=DataResponse[ProfileResponseData])
+@query_budget(1)
 @transactional
 async def create_profile(data: ProfileCreateData, db: DB = Depends()) -> Profile:
     profile = Profile(name=data.name)
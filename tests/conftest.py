@@ -0,0 +1,29 @@
+import socket
+from typing import Iterator
+from urllib.parse import urlparse
+
+import pytest
+from fastapi.testclient import TestClient
+
+from server.config import settings
+from server.main import app
+
+
+def _reachable(url: str, default_port: int) -> bool:
+    parsed = urlparse(url)
+    try:
+        with socket.create_connection((parsed.hostname or "localhost", parsed.port or default_port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+@pytest.fixture(scope="session")
+def client() -> Iterator[TestClient]:
+    """The app with its lifespan, against the configured (migrated) database and redis."""
+    if not _reachable(str(settings.datastores.database_url), 5432) or not _reachable(
+        settings.datastores.redis_url, 6379
+    ):
+        pytest.skip("the database or redis is not reachable")
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,16 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+
+def _create_article(client: TestClient, profile_id: str):
+    return client.post("/api/v1/articles", json={"profile_id": profile_id, "title": "title", "content": "content"})
+
+
+def test_create_article_unknown_profile(client: TestClient):
+    profile_id = str(uuid4())
+
+    res = _create_article(client, profile_id)
+
+    assert res.status_code == 404
+    assert res.json()["detail"] == f"Profile {profile_id} not found"
@@ -0,0 +1,59 @@
+from uuid import UUID
+
+import pytest
+from fastapi.testclient import TestClient
+
+from server.common import entity_cache
+from server.common.database import session_manager
+from server.profiles.model import Profile
+
+
+def _create_profile(client: TestClient, name: str) -> dict:
+    return client.post("/api/v1/profiles", json={"name": name}).json()["data"]
+
+
+def _create_article(client: TestClient, profile_id: str):
+    return client.post("/api/v1/articles", json={"profile_id": profile_id, "title": "title", "content": "content"})
+
+
+async def _get_profile(profile_id: UUID) -> Profile:
+    async with session_manager.session() as db:
+        return await Profile.get(db, profile_id)
+
+
+@pytest.fixture
+def redis_down(monkeypatch: pytest.MonkeyPatch):
+    def get_redis():
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(entity_cache, "get_redis", get_redis)
+
+
+def test_create_article_statements(client: TestClient):
+    profile = _create_profile(client, "create article statements")
+
+    # profile select, article insert and outbox insert, generated columns come back with the inserts
+    res = _create_article(client, profile["id"])
+    assert res.status_code == 200
+    assert res.json()["data"]["profile"]["id"] == profile["id"]
+    assert res.headers["X-DB-Query-Count"] == "3"
+
+    # the profile is answered by the entity cache
+    res = _create_article(client, profile["id"])
+    assert res.status_code == 200
+    assert res.headers["X-DB-Query-Count"] == "2"
+
+
+def test_get_without_redis(client: TestClient, redis_down):
+    profile = _create_profile(client, "get without redis")
+
+    assert str(client.portal.call(_get_profile, UUID(profile["id"])).id) == profile["id"]  # type: ignore
+
+
+def test_create_article_without_redis(client: TestClient, redis_down):
+    profile = _create_profile(client, "create article without redis")
+
+    res = _create_article(client, profile["id"])
+
+    assert res.status_code == 200
+    assert res.json()["data"]["profile"]["id"] == profile["id"]
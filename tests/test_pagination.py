@@ -0,0 +1,26 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from server.common import changes, pagination, response_cache
+
+
+@pytest.fixture
+def redis_down(monkeypatch: pytest.MonkeyPatch):
+    def get_redis():
+        raise ConnectionError("redis is down")
+
+    for module in [changes, pagination, response_cache]:
+        monkeypatch.setattr(module, "get_redis", get_redis)
+
+
+def test_cached_total_without_redis(client: TestClient, redis_down):
+    profile = client.post("/api/v1/profiles", json={"name": "cached total without redis"}).json()["data"]
+    for title in ["first", "second"]:
+        client.post("/api/v1/articles", json={"profile_id": profile["id"], "title": title, "content": "content"})
+
+    # a full first page, so the total isn't known from the page itself and gets counted
+    res = client.get("/api/v1/articles", params={"size": 1})
+
+    assert res.status_code == 200
+    assert res.json()["pagination"]["total_strategy"] == "cached"
+    assert res.json()["pagination"]["total"] >= 2
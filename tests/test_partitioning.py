@@ -0,0 +1,30 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from server.articles.model import Article
+from server.common.database import Base
+from server.common.model import EntityMixin, PartitionedMixin, partitioned_table_args
+
+
+def test_upsert_needs_the_partition_key():
+    rows = [{"title": "title", "content": "content", "profile_id": uuid4()}]
+
+    with pytest.raises(ValueError, match="must include created_at"):
+        asyncio.run(Article.upsert(None, rows, ["id"], ["title"]))  # type: ignore
+
+
+def test_entity_cache_refused():
+    with pytest.raises(TypeError, match="can't set __entity_cache__"):
+
+        class CachedPartitioned(PartitionedMixin, EntityMixin, Base):
+            __tablename__ = "cached_partitioned"
+            __table_args__ = partitioned_table_args()
+            __entity_cache__ = True
+
+    assert "cached_partitioned" not in Base.metadata.tables
+
+
+def test_id_leads_the_primary_key():
+    assert [column.name for column in Article.__table__.primary_key] == ["id", "created_at"]
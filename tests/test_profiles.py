@@ -0,0 +1,11 @@
+from fastapi.testclient import TestClient
+
+
+def test_create_profile_statements(client: TestClient):
+    res = client.post("/api/v1/profiles", json={"name": "create profile statements"})
+
+    # the insert returns everything the response needs, @transactional doesn't refresh the profile
+    assert res.status_code == 200
+    assert res.json()["data"]["name"] == "create profile statements"
+    assert res.json()["data"]["role"] == "user"
+    assert res.headers["X-DB-Query-Count"] == "1"
@@ -0,0 +1,21 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from server.common import changes, response_cache
+
+
+@pytest.fixture
+def redis_down(monkeypatch: pytest.MonkeyPatch):
+    def get_redis():
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(changes, "get_redis", get_redis)
+    monkeypatch.setattr(response_cache, "get_redis", get_redis)
+
+
+def test_list_without_redis(client: TestClient, redis_down):
+    for path in ["/api/v1/articles", "/api/v1/profiles"]:
+        res = client.get(path)
+
+        assert res.status_code == 200
+        assert "data" in res.json()
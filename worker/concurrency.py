@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+from arq import Worker
+
+from server.common.database import DB_POOL_CHECKOUT_DURATION
+from server.common.metrics import REGISTRY, Gauge
+from server.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Window:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    saturated: bool = False
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of jobs the worker picks up at once.
+
+    Every `concurrency_adjust_seconds` the limit is cut by a quarter when the error rate, the job latency
+    (relative to the best latency seen) or the mean wait for a db connection is over its bound, and raised
+    by one when all slots were taken. The limit is applied to the arq worker's `max_jobs`, so jobs over it
+    stay in the queue instead of waiting inside a claimed job. The configured `max_jobs` stays the upper bound.
+    """
+
+    def __init__(self, min_limit: int, max_limit: int):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self._worker: Worker | None = None
+        self._baseline: float | None = None
+        self._checkouts = self._checkout_totals()
+        self._window = Window()
+
+    def attach(self, worker: Worker):
+        self._worker = worker
+        worker.max_jobs = self.limit
+
+    def acquire(self):
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self._window.saturated = True
+
+    def release(self, latency: float, error: bool):
+        self.in_flight -= 1
+        self._window.latencies.append(latency)
+        self._window.errors += error
+
+    @staticmethod
+    def _checkout_totals() -> tuple[int, float]:
+        counts, total = DB_POOL_CHECKOUT_DURATION.values.get((), ([0], [0.0]))
+        return sum(counts), total[0]
+
+    def _checkout_wait(self) -> float:
+        """Mean time checkouts waited for a db connection since the last call."""
+        (count, total), (last_count, last_total) = self._checkout_totals(), self._checkouts
+        self._checkouts = (count, total)
+        return (total - last_total) / (count - last_count) if count > last_count else 0.0
+
+    def adjust(self):
+        window, self._window = self._window, Window()
+        checkout_wait = self._checkout_wait()
+        if not window.latencies:
+            return
+        latency = sum(window.latencies) / len(window.latencies)
+        error_rate = window.errors / len(window.latencies)
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            # let the baseline follow slowly so a permanently slower workload doesn't pin the limit down
+            self._baseline += (latency - self._baseline) * 0.05
+
+        limit = self.limit
+        if (
+            error_rate > settings.task.concurrency_max_error_rate
+            or latency > self._baseline * settings.task.concurrency_latency_tolerance
+            or checkout_wait > settings.task.concurrency_max_db_checkout_wait_seconds
+        ):
+            limit = max(self.min_limit, int(self.limit * 0.75))
+        elif window.saturated:
+            limit = min(self.max_limit, self.limit + 1)
+        if limit != self.limit:
+            logger.info(
+                f"concurrency limit {self.limit} -> {limit} (latency {latency:.3f}s, baseline {self._baseline:.3f}s, "
+                f"errors {error_rate:.0%}, db checkout wait {checkout_wait * 1000:.1f}ms)"
+            )
+            self.limit = limit
+            if self._worker is not None:
+                self._worker.max_jobs = limit
+
+    async def run(self):
+        if self._worker is None:
+            logger.warning("the worker wasn't started by worker.main, the concurrency limit is not applied")
+        while True:
+            await asyncio.sleep(settings.task.concurrency_adjust_seconds)
+            try:
+                self.adjust()
+            except Exception:
+                logger.exception("Unable to adjust the concurrency limit")
+
+
+limiter = AdaptiveLimiter(settings.task.min_jobs, settings.task.max_jobs)
+
+WORKER_CONCURRENCY_LIMIT = Gauge("worker_concurrency_limit", "Current adaptive limit of concurrently running jobs")
+WORKER_JOBS_IN_FLIGHT = Gauge("worker_jobs_in_flight", "Jobs currently holding a concurrency slot")
+
+
+@REGISTRY.collector
+def collect_limiter_metrics():
+    WORKER_CONCURRENCY_LIMIT.set(limiter.limit)
+    WORKER_JOBS_IN_FLIGHT.set(limiter.in_flight)
@@ -1,21 +1,34 @@
+import argparse
 import asyncio
+import contextlib
 import logging
 import logging.config
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from json import JSONEncoder
+from signal import Signals
 
 import coloredlogs
-from arq.cli import watch_reload
+from arq import Worker, cron
 from arq.connections import RedisSettings
-from arq.typing import WorkerSettingsBase
+from arq.typing import WorkerSettingsBase, WorkerSettingsType
+from arq.worker import create_worker as create_arq_worker
 
 from server.common.database import session_manager
+from server.common.entity_cache import run_invalidation_listener
 from server.common.json import TypeAwareEncoder
 from server.common.logging import LOCAL_LOGGING_FORMAT, LOGGING_CONFIG
+from server.common.metrics import run_metrics_publisher
+from server.common.outbox import run_outbox_relay
+from server.common.queue import QueueName, close_queue, init_queue
 from server.common.redis import close_redis
 from server.config import settings
-from worker.tasks.processor import process_article_job
+from worker.concurrency import limiter
+from worker.tasks.maintenance import maintain_partitions_job
+from worker.tasks.processor import process_article_job, process_articles_batch_job
 
 logging.config.dictConfig(LOGGING_CONFIG)
+logger = logging.getLogger(__name__)
 if settings.is_local():
     coloredlogs.install(fmt=LOCAL_LOGGING_FORMAT)
 
@@ -24,34 +37,112 @@ JSONEncoder.default = TypeAwareEncoder.default  # type: ignore
 
 
 async def startup(ctx):
-    pass
+    await init_queue(ctx["redis"])
+    ctx["outbox_relay"] = asyncio.create_task(run_outbox_relay())
+    ctx["concurrency_limiter"] = asyncio.create_task(limiter.run())
+    ctx["metrics_publisher"] = asyncio.create_task(run_metrics_publisher())
+    ctx["entity_cache_invalidation"] = asyncio.create_task(run_invalidation_listener())
+    # spawn so the pool processes don't inherit the event loop and open connections
+    ctx["process_pool"] = ProcessPoolExecutor(
+        max_workers=settings.task.process_pool_size, mp_context=multiprocessing.get_context("spawn")
+    )
 
 
 async def shutdown(ctx):
+    for task in [
+        ctx["outbox_relay"],
+        ctx["concurrency_limiter"],
+        ctx["metrics_publisher"],
+        ctx["entity_cache_invalidation"],
+    ]:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    ctx["process_pool"].shutdown(cancel_futures=True)
+    await close_queue()
     await close_redis()
 
 
 _redis_settings = RedisSettings.from_dsn(settings.datastores.redis_url)
 _redis_settings.conn_timeout = 3
 _redis_settings.conn_retry_delay = 2
-session_manager.init(settings.datastores.sqlalchemy_database_url)
+session_manager.init(settings.datastores.sqlalchemy_database_url, datastores=settings.datastores)
 
 
 class WorkerSettings(WorkerSettingsBase):
     functions = [
         process_article_job,
+        process_articles_batch_job,
+    ]
+    # also at startup so a fresh deployment has its partitions, the job is idempotent
+    cron_jobs = [
+        cron(maintain_partitions_job, hour=settings.partitions.maintenance_hour, minute=0, run_at_startup=True),
     ]
-    cron_jobs = []
     on_startup = startup
     on_shutdown = shutdown
     redis_settings = _redis_settings
+    queue_name = QueueName.interactive
+    # passed to every job, the scheduling wrapper labels and requeues by it
+    ctx = {"queue_name": QueueName.interactive}
     retry_jobs = True
+    max_jobs = settings.task.max_jobs
     max_tries = settings.task.job_max_tries
     timeout_seconds = 300
 
 
+# arq only reads the attributes a settings class defines itself, so the backfill lane copies them
+BackfillWorkerSettings = {
+    **{name: value for name, value in vars(WorkerSettings).items() if not name.startswith("_")},
+    "queue_name": QueueName.backfill,
+    "ctx": {"queue_name": QueueName.backfill},
+    "cron_jobs": [],
+}
+
+
+def create_worker(settings_cls: WorkerSettingsType) -> Worker:
+    """The arq worker, with the adaptive concurrency limit applied to its max_jobs."""
+    worker = create_arq_worker(settings_cls)
+    limiter.attach(worker)
+    return worker
+
+
+async def watch_reload(path: str, settings_cls: WorkerSettingsType):
+    """Run the worker and restart it when files under `path` change, as `arq --watch` does."""
+    from watchfiles import awatch
+
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+
+    def on_stop(signal: Signals):
+        if signal != Signals.SIGUSR1:
+            stop_event.set()
+
+    worker = create_worker(settings_cls)
+    try:
+        worker.on_stop = on_stop
+        loop.create_task(worker.async_run())
+        async for _ in awatch(path, stop_event=stop_event):
+            logger.info("files changed, reloading the worker")
+            worker.handle_sig(Signals.SIGUSR1)
+            await worker.close()
+            loop.create_task(worker.async_run())
+    finally:
+        await worker.close()
+
+
 def main():
-    asyncio.new_event_loop().run_until_complete(watch_reload("worker", WorkerSettings))
+    # the arq cli builds the worker itself, this entry point lets the concurrency limiter resize it
+    parser = argparse.ArgumentParser(description="Run the arq worker")
+    parser.add_argument(
+        "settings", nargs="?", default="WorkerSettings", choices=["WorkerSettings", "BackfillWorkerSettings"]
+    )
+    parser.add_argument("--watch", metavar="PATH", help="reload the worker when files under PATH change")
+    args = parser.parse_args()
+    settings_cls = WorkerSettings if args.settings == "WorkerSettings" else BackfillWorkerSettings
+    if args.watch:
+        asyncio.new_event_loop().run_until_complete(watch_reload(args.watch, settings_cls))
+    else:
+        create_worker(settings_cls).run()
 
 
 if __name__ == "__main__":
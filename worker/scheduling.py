@@ -0,0 +1,106 @@
+import functools
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable
+from uuid import UUID
+
+from arq.utils import timestamp_ms
+
+from server.common.metrics import WAIT_BUCKETS, Counter, Histogram
+from server.common.query_stats import track_queries
+from server.common.queue import JOB_DATA, JobName, QueueName, enqueue
+from server.config import settings
+from worker.concurrency import limiter
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[..., Awaitable[Any]]
+
+
+class FairShare:
+    """Caps the number of a worker's job slots a single profile can occupy at once."""
+
+    def __init__(self, max_jobs: int, max_share: float):
+        self.limit = max(1, int(max_jobs * max_share))
+        self.running: dict[UUID, int] = {}
+        # deferrals of each profile since it last got a slot
+        self.deferrals: dict[UUID, int] = {}
+
+    def try_acquire(self, profile_id: UUID) -> bool:
+        if self.running.get(profile_id, 0) >= self.limit:
+            return False
+        self.running[profile_id] = self.running.get(profile_id, 0) + 1
+        self.deferrals.pop(profile_id, None)
+        return True
+
+    def defer_seconds(self, profile_id: UUID) -> float:
+        """How long to put back a job of a profile over its share, doubling with every deferral in a row."""
+        # the exponent is capped as well, a burst of jobs can defer a profile many times in a row
+        deferrals = min(self.deferrals.get(profile_id, 0), 32)
+        self.deferrals[profile_id] = deferrals + 1
+        backoff = min(settings.task.fair_share_max_defer_seconds, settings.task.fair_share_defer_seconds * 2**deferrals)
+        # jitter keeps the deferred jobs of a profile from all coming back at once
+        return random.uniform(backoff / 2, backoff)
+
+    def release(self, profile_id: UUID):
+        self.running[profile_id] -= 1
+        if self.running[profile_id] <= 0:
+            del self.running[profile_id]
+
+
+fair_share = FairShare(settings.task.max_jobs, settings.task.profile_max_share)
+
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds", "Time between a job becoming ready and starting", ["job", "lane"], buckets=WAIT_BUCKETS
+)
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Duration of job runs, retries count as failed", ["job", "status"], buckets=WAIT_BUCKETS
+)
+JOB_FAIR_SHARE_DEFERRED = Counter("job_fair_share_deferred_total", "Jobs deferred over their profile's share", ["job"])
+
+
+async def _run_limited(job_name: JobName, handler: JobHandler, ctx: dict, *args: Any, **kwargs: Any):
+    limiter.acquire()
+    start = time.perf_counter()
+    error = True
+    try:
+        with track_queries(f"job {job_name}"):
+            res = await handler(ctx, *args, **kwargs)
+        error = False
+        return res
+    finally:
+        latency = time.perf_counter() - start
+        JOB_DURATION.observe(latency, job=job_name, status="failed" if error else "succeeded")
+        limiter.release(latency, error)
+
+
+def scheduled(handler: JobHandler) -> JobHandler:
+    """Wrap a job handler with metrics, per-profile fair sharing and the adaptive concurrency limit.
+
+    Jobs carrying a `profile_id` over the profile's share of slots are put back on the queue
+    with a growing delay instead of running, so other profiles' jobs can take the slots.
+    """
+    job_name = JobName(handler.__name__)
+
+    @functools.wraps(handler)
+    async def wrapped(ctx: dict, *args: Any, **kwargs: Any):
+        wait = max(0, timestamp_ms() - ctx["score"]) / 1000
+        # the lane the job was actually taken from, replays and explicit queue names may differ from queue_for
+        lane = QueueName(ctx["queue_name"])
+        JOB_QUEUE_WAIT.observe(wait, job=job_name, lane=lane.name)
+        profile_id = kwargs.get("profile_id")
+        if profile_id is None:
+            return await _run_limited(job_name, handler, ctx, *args, **kwargs)
+        if not fair_share.try_acquire(profile_id):
+            logger.debug(f"profile {profile_id} is over its share, deferring {job_name}")
+            JOB_FAIR_SHARE_DEFERRED.inc(job=job_name)
+            job_data = JOB_DATA[job_name].model_validate(kwargs)
+            await enqueue(job_name, job_data, defer_by=fair_share.defer_seconds(profile_id), queue_name=lane)
+            return
+        try:
+            return await _run_limited(job_name, handler, ctx, *args, **kwargs)
+        finally:
+            fair_share.release(profile_id)
+
+    return wrapped
@@ -0,0 +1,67 @@
+"""CPU bound article processing.
+
+Everything here runs in the worker's process pool, so functions must be importable at module level
+and take and return picklable values only.
+"""
+
+import asyncio
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import AsyncIterator, Sequence, TypeVar
+
+import trafilatura
+from bs4 import BeautifulSoup
+from htmldate import find_date
+
+WORDS_PER_MINUTE = 238
+
+T = TypeVar("T")
+
+
+@dataclass
+class ArticleAnalysis:
+    text: str
+    published_at: str | None
+    word_count: int
+    reading_time_minutes: float
+
+
+def is_html(content: str) -> bool:
+    return "<" in content and ">" in content
+
+
+def clean_text(content: str) -> str:
+    if is_html(content):
+        content = trafilatura.extract(content) or BeautifulSoup(content, "html.parser").get_text(" ")
+    return " ".join(content.split())
+
+
+def analyze_article(content: str) -> ArticleAnalysis:
+    text = clean_text(content)
+    word_count = len(text.split())
+    return ArticleAnalysis(
+        text=text,
+        published_at=find_date(content) if is_html(content) else None,
+        word_count=word_count,
+        reading_time_minutes=round(word_count / WORDS_PER_MINUTE, 1),
+    )
+
+
+async def analyze_in_pool(pool: Executor, content: str) -> ArticleAnalysis:
+    return await asyncio.get_running_loop().run_in_executor(pool, analyze_article, content)
+
+
+async def analyze_many_in_pool(
+    pool: Executor, items: Sequence[tuple[T, str]]
+) -> AsyncIterator[tuple[T, "asyncio.Future[ArticleAnalysis]"]]:
+    """Analyze `(key, content)` pairs in the pool and yield `(key, future)` as soon as each one finishes.
+
+    Futures are yielded instead of results so the caller can handle each failure on its own.
+    """
+    loop = asyncio.get_running_loop()
+    futures = {loop.run_in_executor(pool, analyze_article, content): key for key, content in items}
+    pending = set(futures)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            yield futures[future], future
@@ -0,0 +1,5 @@
+from server.common.partitions import maintain_partitions
+
+
+async def maintain_partitions_job(ctx: dict):
+    await maintain_partitions()
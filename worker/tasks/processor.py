@@ -1,18 +1,91 @@
-import asyncio
 import logging
+from http.client import NOT_FOUND
 from typing import Any
+from uuid import UUID
 
-from server.common.queue import ProcessJobData
+from arq import Retry
+from fastapi import HTTPException
+
+from server.articles.model import Article
+from server.common.database import session_manager
+from server.common.model import Loading
+from server.common.queue import BatchItem, JobName, ProcessJobData, drain_batch, settle_batch
 from server.common.task import handle_task_failure
+from server.config import settings
+from worker.scheduling import scheduled
+from worker.tasks.analysis import ArticleAnalysis, analyze_in_pool, analyze_many_in_pool
 
 logger = logging.getLogger(__name__)
 
 
+async def process_article(article: Article, analysis: ArticleAnalysis):
+    logger.info(
+        f"processed article {article.id}: {analysis.word_count} words, "
+        f"{analysis.reading_time_minutes} min read, published at {analysis.published_at}"
+    )
+
+
+@scheduled
 async def process_article_job(ctx: dict, *args: Any, **kwargs: Any):
     try:
         data = ProcessJobData.model_validate(kwargs)
-        print(f"processing article {data.article_id}")
-        await asyncio.sleep(5)
-        print(f"done processing article {data.article_id}")
-    except:
-        handle_task_failure(logger, ctx, 60)
+        async with session_manager.session() as db:
+            try:
+                article = await Article.get(db, data.article_id, loading=Loading.none)
+            except HTTPException as e:
+                if e.status_code != NOT_FOUND:
+                    raise
+                # a retry won't bring a deleted article back, the batch job skips missing ids the same way
+                logger.info(f"article {data.article_id} not found, skipping")
+                return
+        analysis = await analyze_in_pool(ctx["process_pool"], article.content)
+        await process_article(article, analysis)
+    except Exception:
+        await handle_task_failure(logger, ctx, 60, JobName.process_article_job, kwargs)
+
+
+async def _load_articles(ids: list[UUID]) -> dict[UUID, Article]:
+    if not ids:
+        return {}
+    async with session_manager.session() as db:
+        return {article.id: article for article in await Article.list(db, Article.id.in_(ids), loading=Loading.none)}
+
+
+@scheduled
+async def process_articles_batch_job(ctx: dict, *args: Any, **kwargs: Any):
+    batch = await drain_batch(JobName.process_articles_batch_job, settings.task.batch_size)
+    done: list[BatchItem] = []
+    retries: list[tuple[BatchItem, int]] = []
+
+    async def item_failed(item: BatchItem):
+        try:
+            await handle_task_failure(
+                logger, {**ctx, "job_try": item.job_try}, 60, JobName.process_articles_batch_job, item.data.model_dump()
+            )
+            done.append(item)
+        except Retry as retry:
+            retries.append((item, retry.defer_score or 0))
+
+    try:
+        try:
+            articles = await _load_articles([item.data.article_id for item in batch.items])  # type: ignore
+        except Exception:
+            for item in batch.items:
+                await item_failed(item)
+        else:
+            found: list[tuple[BatchItem, str]] = []
+            for item in batch.items:
+                if item.data.article_id in articles:  # type: ignore
+                    found.append((item, articles[item.data.article_id].content))  # type: ignore
+                else:
+                    logger.warning(f"article {item.data.article_id} not found, skipping")  # type: ignore
+                    done.append(item)
+            # results are handled in completion order while the rest of the batch keeps running in the pool
+            async for item, analysis in analyze_many_in_pool(ctx["process_pool"], found):
+                try:
+                    await process_article(articles[item.data.article_id], analysis.result())  # type: ignore
+                    done.append(item)
+                except Exception:
+                    await item_failed(item)
+    finally:
+        await settle_batch(batch, done, retries)